@@ -29,7 +29,8 @@ target_metadata = database.Base.metadata
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
-config.set_main_option("sqlalchemy.url", os.getenv("DATABASE_URL"))
+# Always migrate through the sync driver, even when DATABASE_URL selects an async one
+config.set_main_option("sqlalchemy.url", database.engine.url.render_as_string(hide_password=False).replace("%", "%%"))
 
 
 def run_migrations_offline() -> None:
@@ -4,9 +4,14 @@ from datetime import datetime
 from jose import jwt
 from sqladmin import Admin, ModelView
 from sqladmin.authentication import AuthenticationBackend
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
+from data import database
 from data.models import Category, Tag, OptionItem, OptionType, ItemType, User, Ad, Order, SettingItem
+from utils import catalog, crud, payloads
+from utils.settings import settings_store
+from utils.user_cache import user_cache
 
 
 class AdminAuth(AuthenticationBackend):
@@ -32,7 +37,16 @@ class AdminAuth(AuthenticationBackend):
         return True
 
 
-class CategoryAdmin(ModelView, model=Category):
+class CatalogModelView(ModelView):
+    # Any edit to the menu has to drop the in-memory catalog snapshot
+    async def after_model_change(self, data, model, is_created, request):
+        catalog.invalidate()
+
+    async def after_model_delete(self, model, request):
+        catalog.invalidate()
+
+
+class CategoryAdmin(CatalogModelView, model=Category):
     column_list = [Category.name]
     column_searchable_list = [Category.name]
     name_plural = 'Categories'
@@ -41,7 +55,7 @@ class CategoryAdmin(ModelView, model=Category):
     }
 
 
-class TagAdmin(ModelView, model=Tag):
+class TagAdmin(CatalogModelView, model=Tag):
     column_list = [Tag.name, Tag.color]
     column_searchable_list = [Tag.name]
     column_labels = {
@@ -50,7 +64,7 @@ class TagAdmin(ModelView, model=Tag):
     }
 
 
-class OptionItemAdmin(ModelView, model=OptionItem):
+class OptionItemAdmin(CatalogModelView, model=OptionItem):
     column_list = [OptionItem.name, OptionItem.priceChange, OptionItem.type, OptionItem.isDefault, OptionItem.soldOut]
     column_searchable_list = [OptionItem.name]
     column_labels = {
@@ -62,7 +76,7 @@ class OptionItemAdmin(ModelView, model=OptionItem):
     }
 
 
-class OptionTypeAdmin(ModelView, model=OptionType):
+class OptionTypeAdmin(CatalogModelView, model=OptionType):
     column_list = [OptionType.name]
     column_searchable_list = [OptionType.name]
     column_labels = {
@@ -70,7 +84,7 @@ class OptionTypeAdmin(ModelView, model=OptionType):
     }
 
 
-class ItemTypeAdmin(ModelView, model=ItemType):
+class ItemTypeAdmin(CatalogModelView, model=ItemType):
     column_list = [ItemType.category, ItemType.name, ItemType.image, ItemType.tags, ItemType.description, ItemType.shortDescription, ItemType.basePrice, ItemType.salePercent, ItemType.options, ItemType.soldOut]
     column_searchable_list = [ItemType.name]
     column_labels = {
@@ -101,8 +115,16 @@ class UserAdmin(ModelView, model=User):
 
     can_create = False
 
+    async def after_model_change(self, data, model, is_created, request):
+        user_cache.invalidate(model.id)
+        payloads.orders_changed()
+
+    async def after_model_delete(self, model, request):
+        user_cache.invalidate(model.id)
+        payloads.orders_changed()
+
 
-class AdAdmin(ModelView, model=Ad):
+class AdAdmin(CatalogModelView, model=Ad):
     column_list = [Ad.name, Ad.image, Ad.url]
     column_searchable_list = [Ad.name]
     column_labels = {
@@ -142,6 +164,19 @@ class SettingsAdmin(ModelView, model=SettingItem):
         SettingItem.value: 'Value'
     }
 
+    async def after_model_change(self, data, model, is_created, request):
+        await run_in_threadpool(bump_settings_version)
+
+    async def after_model_delete(self, model, request):
+        await run_in_threadpool(bump_settings_version)
+
+
+def bump_settings_version():
+    with database.ind_db() as db:
+        crud.bump_settings_version(db)
+        db.commit()
+    settings_store.invalidate()
+
 
 def create_admin(app, engine):
     admin = Admin(app, engine,
@@ -1,12 +1,32 @@
 from contextlib import contextmanager
 
 from fastapi_storages import FileSystemStorage
-from sqlalchemy import create_engine
+from sqlalchemy import AsyncAdaptedQueuePool, create_engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
-engine = create_engine(os.getenv("DATABASE_URL"))
+# An async driver in DATABASE_URL (e.g. sqlite+aiosqlite, mysql+asyncmy) opts into async mode for the hot routes.
+# The admin, migrations and scheduler keep using the matching sync driver against the same database.
+SYNC_DRIVERS = {"aiosqlite": "pysqlite", "asyncmy": "pymysql", "aiomysql": "pymysql"}
+
+database_url = make_url(os.getenv("DATABASE_URL"))
+async_mode = database_url.get_dialect().is_async
+if async_mode:
+    engine = create_engine(database_url.set(drivername=database_url.get_backend_name() + "+" + SYNC_DRIVERS[database_url.get_driver_name()]))
+    if database_url.get_backend_name() == "sqlite":
+        # SQLite has a single writer. Concurrent async sessions each opening a write transaction fail with "database
+        # is locked" instead of queueing, so they share one connection and wait for the file lock like the sync driver
+        async_engine = create_async_engine(database_url, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=60,
+                                           connect_args={"timeout": 30})
+    else:
+        async_engine = create_async_engine(database_url)
+    AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
+else:
+    engine = create_engine(database_url)
+    async_engine = None
+    AsyncSessionLocal = None
 storage = FileSystemStorage("uploads")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
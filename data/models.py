@@ -1,7 +1,7 @@
 import enum
 
 from fastapi_storages.integrations.sqlalchemy import FileType
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DECIMAL, Enum, DateTime, Table
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DECIMAL, Enum, DateTime, Table, Index, Date, Double
 from sqlalchemy.orm import relationship
 
 from data.database import Base, storage
@@ -34,13 +34,18 @@ class User(Base):
     __tablename__ = 'users'
 
     id = Column(String(9), primary_key=True)
-    name = Column(String(255))
+    name = Column(String(255), index=True)
     pinyin = Column(String(255))
     phone = Column(String(255))
     permissions = Column(String(1024), default="")
     blocked = Column(Boolean, default=False)
     orders = relationship('Order', back_populates='user')
     points = Column(DECIMAL(5, 2), nullable=False)
+    # Lifetime totals maintained alongside every order change, see crud.change_user_totals
+    totalOrders = Column(Integer, default=0, nullable=False)
+    totalCups = Column(Integer, default=0, nullable=False)
+    totalSpent = Column(DECIMAL(10, 2), default=0, nullable=False)
+    activeOrderId = Column(Integer)  # Latest order that is still waiting or unpaid
 
     def __str__(self):
         return self.name + ' (' + self.pinyin + ')'
@@ -118,7 +123,7 @@ class OrderedItem(Base):
     __tablename__ = 'ordereditems'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    orderId = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'))
+    orderId = Column(Integer, ForeignKey('orders.id', ondelete='CASCADE'), index=True)
     order = relationship('Order', back_populates='items')
     itemTypeId = Column(Integer, ForeignKey('itemtypes.id', ondelete='SET NULL'))
     itemType = relationship('ItemType')
@@ -141,6 +146,16 @@ class OrderType(enum.Enum):
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        Index('ix_orders_createdTime', 'createdTime'),
+        Index('ix_orders_status_createdTime', 'status', 'createdTime'),
+        Index('ix_orders_userId_createdTime', 'userId', 'createdTime'),
+        Index('ix_orders_number_createdTime', 'number', 'createdTime'),
+        Index('ix_orders_businessDate_number', 'businessDate', 'number', unique=True),
+        Index('ix_orders_userId_paid_createdTime', 'userId', 'paid', 'createdTime'),
+        Index('ix_orders_userId_status_createdTime', 'userId', 'status', 'createdTime'),
+        Index('ix_orders_onSiteName_paid', 'onSiteName', 'paid'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     items = relationship('OrderedItem', back_populates='order')
@@ -148,6 +163,7 @@ class Order(Base):
     number = Column(String(5))
     status = Column(Enum(OrderStatus))
     createdTime = Column(DateTime)
+    businessDate = Column(Date)
     type = Column(Enum(OrderType))
     deliveryRoom = Column(String(64))
     userId = Column(String(9), ForeignKey('users.id', ondelete='SET NULL'))
@@ -169,3 +185,54 @@ class SettingItem(Base):
 
     key = Column(String(32), primary_key=True)
     value = Column(String(2048))
+
+
+class DailyCounter(Base):
+    __tablename__ = 'dailycounters'
+
+    businessDate = Column(Date, primary_key=True)
+    onlineCups = Column(Integer, default=0, nullable=False)
+    onSiteCups = Column(Integer, default=0, nullable=False)
+    lastNumber = Column(Integer, default=0, nullable=False)
+    lastChange = Column(Integer, default=0, nullable=False)
+
+
+class DailyStats(Base):
+    __tablename__ = 'dailystats'
+
+    businessDate = Column(Date, primary_key=True)
+    revenue = Column(DECIMAL(10, 2), default=0, nullable=False)  # Paid orders only
+    orderValue = Column(DECIMAL(10, 2), default=0, nullable=False)  # Every order, paid or not
+    orders = Column(Integer, default=0, nullable=False)
+    paidOrders = Column(Integer, default=0, nullable=False)
+    cups = Column(Integer, default=0, nullable=False)
+    uniqueUsers = Column(Integer, default=0, nullable=False)
+    pickUpOrders = Column(Integer, default=0, nullable=False)
+    deliveryOrders = Column(Integer, default=0, nullable=False)
+    onSiteOrders = Column(Integer, default=0, nullable=False)
+    onlineOrders = Column(Integer, default=0, nullable=False)
+    onSiteCups = Column(Integer, default=0, nullable=False)
+    onlineCups = Column(Integer, default=0, nullable=False)
+
+
+class OrderChange(Base):
+    # Change log behind /orders/today/changes, one row per create, status change or delete
+    __tablename__ = 'orderchanges'
+    __table_args__ = (
+        Index('ix_orderchanges_businessDate_seq', 'businessDate', 'seq', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    businessDate = Column(Date, nullable=False)
+    seq = Column(Integer, nullable=False)
+    orderId = Column(Integer, nullable=False)  # No foreign key, tombstones outlive their order
+    deleted = Column(Boolean, default=False, nullable=False)
+
+
+class RateLimitBucket(Base):
+    # Token buckets of utils.ratelimit.DatabaseBackend, shared by every worker
+    __tablename__ = 'ratelimitbuckets'
+
+    key = Column(String(255), primary_key=True)
+    tokens = Column(Double, nullable=False)
+    updatedAt = Column(Double, nullable=False)  # Unix time of the last refill
@@ -19,6 +19,10 @@ class UserSchema(BaseModel):
 
 class UserSchemaSecure(UserSchema):
     phone: str | None
+    totalOrders: int
+    totalCups: int
+    totalSpent: Decimal
+    activeOrderId: int | None
 
     class Config:
         from_attributes = True
@@ -40,12 +44,18 @@ class CategorySchema(BaseModel):
     id: int
     name: str
 
+    class Config:
+        from_attributes = True
+
 
 class TagSchema(BaseModel):
     id: int
     name: str
     color: str
 
+    class Config:
+        from_attributes = True
+
 
 class OptionItemSchema(BaseModel):
     id: int
@@ -122,6 +132,48 @@ class OrderSchema(BaseModel):
         from_attributes = True
 
 
+class OrderChangesSchema(BaseModel):
+    cursor: str  # Pass back as since= to get the next changes
+    reset: bool  # The cursor was missing or from another day, orders is the full list and should replace it
+    orders: List[OrderSchema]  # The embedded user is as of the order's own last change
+    deleted: List[int]
+
+
+class OrderedItemSummarySchema(BaseModel):
+    id: int
+    itemTypeId: int | None  # Resolve against /items
+    appliedOptionIds: List[int]
+    amount: int
+
+
+class OrderSummarySchema(BaseModel):
+    # Compact OrderSchema for staff boards. With fields=, only the requested keys are present
+    id: int
+    totalPrice: Decimal
+    number: str
+    status: str  # waiting, done
+    createdTime: datetime
+    type: str  # pickUp, delivery
+    deliveryRoom: str | None
+    userId: str | None
+    userName: str | None
+    items: List[OrderedItemSummarySchema]
+    onSiteName: str | None
+    paid: bool
+
+
+class OrderSummaryCursorPageSchema(BaseModel):
+    items: List[OrderSummarySchema]
+    size: int
+    nextCursor: str | None
+
+
+class OrderCursorPageSchema(BaseModel):
+    items: List[OrderSchema]
+    size: int
+    nextCursor: str | None  # None on the last page
+
+
 class OrderStatusUpdateSchema(BaseModel):
     id: int
     status: str | None  # waiting, done
@@ -168,6 +220,9 @@ class AdSchema(BaseModel):
     image: str
     url: str
 
+    class Config:
+        from_attributes = True
+
 
 class StatsAggregateSchema(BaseModel):
     todayRevenue: Decimal
@@ -7,12 +7,36 @@ from fastapi_pagination import add_pagination
 from starlette.middleware.cors import CORSMiddleware
 from starlette.staticfiles import StaticFiles
 
+from data import database
 from data.admin import create_admin
 from data.database import engine
 from routers import user, api, manage
+from utils import onelogin
+from utils.admission import AdmissionMiddleware
+from utils.order_queue import queue
 from utils.scheduling import start_scheduler
 
-app = FastAPI(root_path=urllib.parse.urlparse(os.environ['API_HOST']).path)
+# The menu catalog, the response caches and the order queue are kept in process memory and only invalidated by
+# writes made in this process, so the app has to run as exactly one worker
+if int(os.environ.get("WEB_CONCURRENCY", "1")) != 1:
+    raise RuntimeError("Whale must run as a single worker, unset WEB_CONCURRENCY")
+
+scheduler = start_scheduler()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    with database.ind_db() as db:
+        queue.rebuild(db)
+    try:
+        yield
+    finally:
+        scheduler.shutdown()
+        await onelogin.close_client()
+
+
+app = FastAPI(root_path=urllib.parse.urlparse(os.environ['API_HOST']).path, lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
 
 if os.environ.get("DEVELOPMENT") == "true":
     app.add_middleware(
@@ -26,17 +50,6 @@ if os.environ.get("DEVELOPMENT") == "true":
 if not os.path.exists("uploads"):
     os.makedirs("uploads")
 
-scheduler = start_scheduler()
-
-
-@asynccontextmanager
-async def lifespan(app):
-    try:
-        yield
-    finally:
-        scheduler.shutdown()
-
-
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 app.include_router(api.router)
 app.include_router(manage.router)
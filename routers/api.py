@@ -1,97 +1,155 @@
-import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
 
-from data.models import OrderStatus, Order, User
+from data import database
+from data.models import OrderStatus, Order
 from data.schemas import ItemTypeSchema, CategorySchema, OrderSchema, OrderEstimateSchema, OrderCreateSchema, AdSchema, \
-    OrderQuotaSchema
-from utils import crud
-from utils.dependencies import get_db, get_current_user, TIME_ZONE
+    OrderQuotaSchema, OrderCursorPageSchema
+from utils import crud, crud_async, caching, catalog, events, order_queue
+from utils.dependencies import get_db, get_async_db, get_current_identity
+from utils.payloads import payload_cache
+from utils.ratelimit import RateLimit
+from utils.settings import settings_store
+from utils.user_cache import UserSnapshot
 
 router = APIRouter()
 
 
-@router.get("/items", response_model=list[ItemTypeSchema])
-def get_items(category: int | None = None, db: Session = Depends(get_db)):
+@router.get("/items", response_model=list[ItemTypeSchema], dependencies=[Depends(caching.ITEMS_CACHE)])
+def get_items(response: Response, category: int | None = None, db: Session = Depends(get_db)):
+    snapshot = catalog.get_catalog(db)
     if category is not None:
-        return crud.get_item_types_by_category(db, category)
-    return crud.get_item_types(db)
+        return payload_cache.respond(("items", snapshot.version, category),
+                                     lambda: snapshot.get_item_types_by_category(category), list[ItemTypeSchema],
+                                     response)
+    return payload_cache.respond(("items", snapshot.version), snapshot.get_item_types, list[ItemTypeSchema], response)
 
 
-@router.get("/item", response_model=ItemTypeSchema)
+@router.get("/item", response_model=ItemTypeSchema, dependencies=[Depends(caching.ITEMS_CACHE)])
 def get_item(id: int, db: Session = Depends(get_db)):
-    return crud.ensure_not_none(crud.get_item_type(db, id))
+    return crud.ensure_not_none(catalog.get_catalog(db).get_item_type(id))
 
 
-@router.get("/categories", response_model=list[CategorySchema])
+@router.get("/categories", response_model=list[CategorySchema], dependencies=[Depends(caching.CATEGORIES_CACHE)])
 def get_categories(db: Session = Depends(get_db)):
-    return crud.get_categories(db)
+    return catalog.get_catalog(db).get_categories()
 
 
-@router.get("/category", response_model=CategorySchema)
+@router.get("/category", response_model=CategorySchema, dependencies=[Depends(caching.CATEGORIES_CACHE)])
 def get_category(id: int, db: Session = Depends(get_db)):
-    return crud.ensure_not_none(crud.get_category(db, id))
+    return crud.ensure_not_none(catalog.get_catalog(db).get_category(id))
 
 
-@router.get("/settings", response_model=str)
+@router.get("/settings", response_model=str, dependencies=[Depends(caching.SETTINGS_CACHE)])
 def get_setting(key: str, db: Session = Depends(get_db)):
-    setting = crud.get_settings(db, key)
-    return "0" if setting is None else setting.value
+    value = crud.get_settings(db, key)
+    return "0" if value is None else value
 
 
 @router.get("/order", response_model=OrderSchema)
-def get_order(id: int, db: Session = Depends(get_db)):
-    return crud.ensure_not_none(crud.get_order(db, id))
+async def get_order(id: int, db: AsyncSession | Session = Depends(get_async_db)):
+    return crud.ensure_not_none(await crud_async.get_order(db, id))
 
 
 @router.get("/order/by-number", response_model=OrderSchema)
-def get_order(number: str, db: Session = Depends(get_db)):
-    return crud.ensure_not_none(crud.get_order_by_number(db, number))
+async def get_order_by_number(number: str, db: AsyncSession | Session = Depends(get_async_db)):
+    return crud.ensure_not_none(await crud_async.get_order_by_number(db, number))
 
 
-@router.get("/order/estimate", response_model=OrderEstimateSchema)
+@router.get("/order/estimate", response_model=OrderEstimateSchema,
+            dependencies=[Depends(RateLimit("estimate", rate=5, burst=30, by_user=False))])
 def estimate(id: int | None = None, db: Session = Depends(get_db)):
-    amount = 0
-    order = None
-    if id is not None:
-        order = crud.ensure_not_none(crud.get_order(db, id))
+    queue = order_queue.get_queue(db)
+    if id is None:
+        orders, cups = queue.totals()
+        return OrderEstimateSchema(time=cups * 2, orders=orders, type=None, number=None, status=None)
+
+    entry = queue.get(id)
+    if entry is None:
+        order = crud.ensure_not_none(db.get(Order, id))
         if order.status == OrderStatus.done:
-            return OrderEstimateSchema(
-                time=0,
-                orders=0,
-                type=None if order is None else order.type,
-                number=None if order is None else order.number,
-                status=None if order is None else order.status
-            )
-        for item in order.items:
-            amount += item.amount
-        matching_orders = (db.query(Order)
-                           .filter(Order.createdTime < order.createdTime)
-                           .filter(Order.status == OrderStatus.waiting)
-                           .all())
-    else:
-        matching_orders = (db.query(Order)
-                           .filter(Order.status == OrderStatus.waiting)
-                           .all())
+            return OrderEstimateSchema(time=0, orders=0, type=order.type, number=order.number, status=order.status)
+        # A waiting order we don't know about means another writer got ahead of us
+        queue.rebuild(db)
+        entry = crud.ensure_not_none(queue.get(id))
+
+    result = queue_estimate(queue, id)
+    if result is None:
+        # Completed between the two lookups
+        return OrderEstimateSchema(time=0, orders=0, type=entry.type, number=entry.number, status=OrderStatus.done)
+    return result
 
-    for o in matching_orders:
-        for i in o.items:
-            amount += i.amount
+
+def queue_estimate(queue: order_queue.OrderQueue, id: int) -> OrderEstimateSchema | None:
+    # Estimate of a waiting order from the in-memory queue alone, None once it has left the queue
+    entry = queue.get(id)
+    ahead = queue.ahead_of(id)
+    if entry is None or ahead is None:
+        return None
+    orders, cups = ahead
     return OrderEstimateSchema(
-        time=amount * 2,
-        orders=len(matching_orders),
-        type=None if order is None else order.type,
-        number=None if order is None else order.number,
-        status=None if order is None else order.status
+        time=(cups + entry.cups) * 2,
+        orders=orders,
+        type=entry.type,
+        number=entry.number,
+        status=OrderStatus.waiting
     )
 
 
+def load_estimate(id: int):
+    with database.ind_db() as db:
+        return estimate(id, db)
+
+
+@router.get("/order/events")
+async def order_events(id: int, request: Request):
+    # Server-sent events: the estimate of one order, sent again whenever it changes, until the order is done
+    # Subscribed before the first read, so a change landing in between still wakes the stream
+    subscription = events.broadcaster.subscribe()
+    try:
+        current = await run_in_threadpool(load_estimate, id)
+    except Exception:
+        subscription.close()
+        raise
+
+    async def stream():
+        nonlocal current
+        last = None
+        try:
+            while True:
+                if current != last:
+                    yield f"data: {current.model_dump_json()}\n\n"
+                    last = current
+                if current.status == OrderStatus.done.value:
+                    return
+                if not await subscription.wait(timeout=15):
+                    if await request.is_disconnected():
+                        return
+                    # Keeps proxies from closing an idle connection
+                    yield ": ping\n\n"
+                    continue
+                current = queue_estimate(order_queue.queue, id)
+                if current is None:
+                    # Left the queue: done, deleted or re-queued by another writer, the database knows which
+                    current = await run_in_threadpool(load_estimate, id)
+        except HTTPException:
+            # Deleted while subscribed
+            return
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @router.delete("/order", response_model=bool)
-def cancel_order(id: int, user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def cancel_order(id: int, user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if user.blocked:
         raise HTTPException(status_code=403, detail="User is blocked")
     order = crud.ensure_not_none(crud.get_order(db, id))
@@ -103,26 +161,12 @@ def cancel_order(id: int, user: Annotated[User, Depends(get_current_user)], db:
 
 @router.get("/order/on-site-eligibility", response_model=bool)
 def on_site_eligibility(name: str, db: Session = Depends(get_db)):
-    orders = crud.get_orders_by_on_site_name(db, name)
-    for o in orders:
-        if not o.paid:
-            return False
-    return True
+    return not crud.has_unpaid_order(db, on_site_name=name)
 
 
 @router.get("/order/quota", response_model=OrderQuotaSchema)
 def order_quota(db: Session = Depends(get_db)):
-    today = datetime.datetime.now(TIME_ZONE)
-    online = 0
-    on_site = 0
-    for o in crud.get_orders_by_date(db, datetime.datetime(today.year, today.month, today.day, 0, 0, 0, tzinfo=TIME_ZONE)):
-        if o.onSiteName is None:
-            for i in o.items:
-                online += i.amount
-        else:
-            for i in o.items:
-                on_site += i.amount
-
+    online, on_site = crud.get_daily_cups(db, crud.get_business_date())
     return OrderQuotaSchema(
         onSiteToday=on_site,
         onlineToday=online
@@ -134,8 +178,13 @@ def can_match_user(name: str, db: Session = Depends(get_db)):
     return crud.try_match_user(db, name) is not None
 
 
-@router.post("/order", response_model=OrderSchema)
-def order(order: OrderCreateSchema, user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+@router.post("/order", response_model=OrderSchema, dependencies=[Depends(RateLimit("order", rate=0.2, burst=3))])
+async def order(order: OrderCreateSchema, user: Annotated[UserSnapshot, Depends(get_current_identity)],
+                db: AsyncSession | Session = Depends(get_async_db)):
+    return await crud_async.run(db, place_order, order, user)
+
+
+def place_order(db: Session, order: OrderCreateSchema, user: UserSnapshot):
     if user.blocked:
         raise HTTPException(status_code=403, detail="User is blocked")
     if order.onSiteOrder and "admin.manage" not in user.permissions:
@@ -144,41 +193,40 @@ def order(order: OrderCreateSchema, user: Annotated[User, Depends(get_current_us
         if not on_site_eligibility(order.onSiteName, db):
             raise HTTPException(status_code=403, detail="User has an active order")
     else:
-        for o in crud.get_orders_by_user(db, user.id):
-            if not o.paid:
-                raise HTTPException(status_code=403, detail="User has an active order")
+        if crud.has_unpaid_order(db, user_id=user.id):
+            raise HTTPException(status_code=403, detail="User has an active order")
     today_quota = order_quota(db)
-    quota = crud.get_settings(db, "total-quota")
-    quota = int(quota.value) if quota is not None else 999
+    quota = settings_store.get_int(db, "total-quota", 999)
     if today_quota.onSiteToday + today_quota.onlineToday >= quota:
-        # CAVEAT: We allow for a single order to exceed the quota
+        # Early rejection only, create_order reserves against the counter atomically
         raise HTTPException(status_code=403, detail="Order exceeds quota")
 
-    total = 0
-    for item in order.items:
-        total += item.amount
-        if crud.get_item_type(db, item.itemType).soldOut:
-            raise HTTPException(status_code=403, detail="Item sold out")
-        for option in item.appliedOptions:
-            if crud.get_option_item(db, option).soldOut:
-                raise HTTPException(status_code=403, detail="Option sold out")
-
-    total_quota = crud.get_settings(db, "order-quota")
-    total_quota = int(total_quota.value) if total_quota is not None else 999
+    cart = crud.resolve_cart(db, order.items)
+    total = sum(item.amount for item in order.items)
+
+    total_quota = settings_store.get_int(db, "order-quota", 999)
     if total > total_quota:
         raise HTTPException(status_code=403, detail="Order exceeds quota")
 
-    result = crud.create_order(db, order, user)
-    return result
+    result = crud.create_order(db, order, user, quota, cart)
+    return OrderSchema.model_validate(result)
 
 
 @router.get("/orders", response_model=Page[OrderSchema])
-def user_orders(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def user_orders(user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if user.blocked:
         raise HTTPException(status_code=403, detail="User is blocked")
     return paginate(db, crud.get_orders_query_by_user(user.id))
 
 
-@router.get("/pms", response_model=list[AdSchema])
+@router.get("/orders/cursor", response_model=OrderCursorPageSchema)
+def user_orders_cursor(user: Annotated[UserSnapshot, Depends(get_current_identity)], cursor: str | None = None,
+                       size: int = Query(50, ge=1, le=100), db: Session = Depends(get_db)):
+    if user.blocked:
+        raise HTTPException(status_code=403, detail="User is blocked")
+    return crud.paginate_orders_by_cursor(db, crud.get_orders_query_by_user(user.id), cursor, size)
+
+
+@router.get("/pms", response_model=list[AdSchema], dependencies=[Depends(caching.ADS_CACHE)])
 def ads(db: Session = Depends(get_db)):
-    return crud.get_ads(db)
+    return catalog.get_catalog(db).get_ads()
@@ -1,55 +1,115 @@
+import csv
+import json
 import os
+import tempfile
 import time
+import zlib
 from datetime import date, timedelta, datetime, timezone
 from decimal import Decimal
-from io import BytesIO
-from typing import Annotated
+from io import BytesIO, StringIO
+from typing import Annotated, Any
 
 import xlsxwriter
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
-from data.models import User, Order, OrderType, OrderStatus
-from data.schemas import OrderSchema, OrderStatusUpdateSchema, StatsAggregateSchema
-from utils import crud
-from utils.dependencies import get_current_user, get_db, TIME_ZONE
+from data import database
+from data.models import DailyStats, Order, OrderType, OrderStatus
+from data.schemas import OrderSchema, OrderStatusUpdateSchema, StatsAggregateSchema, OrderCursorPageSchema, \
+    OrderSummarySchema, OrderSummaryCursorPageSchema, OrderChangesSchema
+from utils import admission, catalog, crud, payloads
+from utils.dependencies import get_current_identity, get_db, TIME_ZONE
+from utils.user_cache import UserSnapshot, user_cache
 
 router = APIRouter()
 
 
 @router.get("/settings/update", response_model=str)
-def update_settings(key: str, value: str, user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def update_settings(key: str, value: str, user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if "admin.manage" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
     return crud.update_settings(db, key, value)
 
 
 @router.get("/orders/today", response_model=list[OrderSchema])
-def today_orders(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def today_orders(user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if "admin.manage" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
-    return crud.get_orders_today(db)
+    # Polled by every staff screen; the body is only rebuilt after an order, user or catalog change
+    key = ("orders-today", crud.get_business_date(), payloads.get_orders_version(), catalog.get_version())
+    return payloads.payload_cache.respond(key, lambda: crud.get_orders_today(db), list[OrderSchema])
+
+
+@router.get("/orders/today/changes", response_model=OrderChangesSchema)
+def today_order_changes(user: Annotated[UserSnapshot, Depends(get_current_identity)], since: str | None = None,
+                        db: Session = Depends(get_db)):
+    # Delta sync for the order board: only what was created, updated or deleted after the cursor
+    if "admin.manage" not in user.permissions:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    today = crud.get_business_date()
+    seq = None
+    if since is not None:
+        try:
+            day, seq = since.split(".")
+            seq = int(seq) if date.fromisoformat(day) == today else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if seq is None:
+        # Read the sequence first, anything committed after it is sent again next time rather than missed
+        last = crud.get_last_order_change(db, today)
+        return OrderChangesSchema(cursor=f"{today.isoformat()}.{last}", reset=True,
+                                  orders=crud.get_orders_today(db), deleted=[])
+    orders, deleted, last = crud.get_order_changes(db, today, seq)
+    return OrderChangesSchema(cursor=f"{today.isoformat()}.{last}", reset=False, orders=orders, deleted=deleted)
+
+
+@router.get("/orders/today/summary", response_model=list[OrderSummarySchema])
+def today_order_summaries(user: Annotated[UserSnapshot, Depends(get_current_identity)], fields: str | None = None,
+                          db: Session = Depends(get_db)):
+    if "admin.manage" not in user.permissions:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    fields = crud.parse_summary_fields(fields)
+    key = ("orders-today-summary", crud.get_business_date(), payloads.get_orders_version(), fields)
+    return payloads.payload_cache.respond(key, lambda: crud.get_order_summaries_today(db, fields), list[dict[str, Any]])
 
 
 @router.get("/orders/all", response_model=Page[OrderSchema])
-def all_orders(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def all_orders(user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if "admin.manage" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
     return paginate(db, crud.get_orders())
 
 
+@router.get("/orders/all/cursor", response_model=OrderCursorPageSchema)
+def all_orders_cursor(user: Annotated[UserSnapshot, Depends(get_current_identity)], cursor: str | None = None,
+                      size: int = Query(50, ge=1, le=100), db: Session = Depends(get_db)):
+    if "admin.manage" not in user.permissions:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return crud.paginate_orders_by_cursor(db, crud.get_orders(), cursor, size)
+
+
+@router.get("/orders/all/summary", response_model=OrderSummaryCursorPageSchema)
+def all_order_summaries(user: Annotated[UserSnapshot, Depends(get_current_identity)], cursor: str | None = None,
+                        size: int = Query(50, ge=1, le=100), fields: str | None = None, db: Session = Depends(get_db)):
+    if "admin.manage" not in user.permissions:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    page = crud.get_order_summaries_page(db, cursor, size, crud.parse_summary_fields(fields))
+    # Projected items would fail response_model validation, so the page is encoded the same way as the cached payloads
+    return payloads.JSONBytesResponse(payloads.payload_cache.serialize(page, dict[str, Any]))
+
+
 @router.patch("/order", response_model=OrderSchema)
-def update_order_status(data: OrderStatusUpdateSchema, user: Annotated[User, Depends(get_current_user)],
+def update_order_status(data: OrderStatusUpdateSchema, user: Annotated[UserSnapshot, Depends(get_current_identity)],
                         db: Session = Depends(get_db)):
     order = crud.ensure_not_none(crud.get_order(db, data.id))
     if "admin.manage" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
     crud.update_order_status(db, order, data.status, data.paid)
-    return order
+    return crud.get_order(db, order.id)
 
 
 stats_last_cached = {"day": 0, "week": 0, "month": 0, "year": 0, "individual": 0}
@@ -66,84 +126,49 @@ def get_statistics(by: str, limit: int, db: Session) -> StatsAggregateSchema:
     def get_start_of_week(date):
         return date - timedelta(days=date.weekday())
 
-    def get_start_of_month(date):
-        return datetime(date.year, date.month, 1, 0, 0, 0, tzinfo=TIME_ZONE)
-
-    if by == "week":
-        get_start_date = get_start_of_week
-    elif by == "month":
-        get_start_date = get_start_of_month
-    else:  # Default to by day
-        get_start_date = lambda x: x
-
-    orders = db.query(Order).filter(Order.createdTime >= (datetime.now(tz=TIME_ZONE) - timedelta(days=limit))).order_by(
-        Order.createdTime.desc()).all()
     revenue = {}
     orders_count = {}
     unique_users = {}
     cups = {}
-    for order in orders:
-        if by == "individual":
-            day = order.createdTime.strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            day = get_start_date(order.createdTime).strftime("%Y-%m-%d")
-
-        if order.paid:
-            if day in revenue:
-                revenue[day] += order.totalPrice
-            else:
-                revenue[day] = Decimal(order.totalPrice)
-
-        if day in orders_count:
-            orders_count[day] += 1
-        else:
-            orders_count[day] = 1
-
-        cup = 0
-        for item in order.items:
-            cup += item.amount
-        if day in cups:
-            cups[day] += cup
-        else:
-            cups[day] = cup
-
-        if day not in unique_users:
-            unique_users[day] = set()
-        unique_users[day].add(order.userId)
-
-    for day, users in unique_users.items():
-        unique_users[day] = len(users)
-
-    today = date.today()
-
-    start_of_day = datetime.combine(date.today(), datetime.min.time(), tzinfo=TIME_ZONE)
-    end_of_day = datetime.combine(date.today(), datetime.max.time(), tzinfo=TIME_ZONE)
+    since = datetime.now(tz=TIME_ZONE) - timedelta(days=limit)
+    if by == "individual":
+        stats = crud.aggregate_orders(db, crud.get_stats_bucket(db, by), Order.createdTime >= since)
+    else:
+        # Summed from the daily rollup, a few hundred rows at most
+        stats = crud.aggregate_daily_stats(db, crud.get_stats_bucket(db, by, DailyStats.businessDate),
+                                           DailyStats.businessDate >= since.date())
+    for bucket, (bucket_orders, bucket_revenue, bucket_users, bucket_cups) in stats.items():
+        if bucket_revenue is not None:
+            revenue[bucket] = Decimal(bucket_revenue)
+        orders_count[bucket] = bucket_orders
+        cups[bucket] = bucket_cups
+        unique_users[bucket] = bucket_users
+    if by in ("week", "month"):
+        # Distinct users do not add up across days
+        unique_users = crud.count_unique_users(db, crud.get_stats_bucket(db, by), Order.businessDate >= since.date())
+
+    today = crud.get_business_date()
     start_of_week = get_start_of_week(today)
     end_of_week = start_of_week + timedelta(days=6)
 
     today_revenue = 0
     today_orders = 0
     today_cups = 0
-    today_unique_users = set()
-    week_revenue = 0
+    today_unique_users = 0
+    for row in crud.get_daily_stats(db, since=today, until=today):
+        today_revenue = row.revenue
+        today_orders = row.orders
+        today_cups = row.cups
+        today_unique_users = row.uniqueUsers
 
-    for order in db.query(Order).filter(Order.createdTime >= start_of_day, Order.createdTime <= end_of_day).all():
-        if order.paid:
-            today_revenue += order.totalPrice
-        today_orders += 1
-        for item in order.items:
-            today_cups += item.amount
-        today_unique_users.add(order.userId)
-
-    for order in db.query(Order).filter(Order.createdTime >= start_of_week, Order.createdTime <= end_of_week).all():
-        week_revenue += order.totalPrice
+    week_revenue = crud.get_order_value(db, start_of_week, end_of_week)
 
     stats_last_cached[by] = time.time()
     stats_cache[by] = StatsAggregateSchema(
         todayRevenue=today_revenue,
         todayOrders=today_orders,
         todayCups=today_cups,
-        todayUniqueUsers=len(today_unique_users),
+        todayUniqueUsers=today_unique_users,
         weekRevenue=week_revenue,
         weekRevenueRange=f"{start_of_week.strftime('%Y-%m-%d')} - {end_of_week.strftime('%Y-%m-%d')}",
         revenue=revenue,
@@ -155,10 +180,13 @@ def get_statistics(by: str, limit: int, db: Session) -> StatsAggregateSchema:
 
 
 @router.get("/statistics/export/token", response_model=str)
-def statistics_export_token(type: str, by: str, limit: int, user: Annotated[User, Depends(get_current_user)]):
+def statistics_export_token(type: str, by: str, limit: int, user: Annotated[UserSnapshot, Depends(get_current_identity)],
+                            format: str = "xlsx", gzip: bool = False):
     if "admin.cms" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
-    return jwt.encode({"type": type, "by": by, "limit": limit, "exp": datetime.now(timezone.utc) + timedelta(minutes=15)}, key=os.environ["JWT_SECRET_KEY"], algorithm="HS256")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Bad export format")
+    return jwt.encode({"type": type, "by": by, "limit": limit, "format": format, "gzip": gzip, "exp": datetime.now(timezone.utc) + timedelta(minutes=15)}, key=os.environ["JWT_SECRET_KEY"], algorithm="HS256")
 
 
 @router.get("/statistics/export")
@@ -168,64 +196,153 @@ def statistics_export(token: str, db: Session = Depends(get_db)):
         type = payload["type"]
         by = payload["by"]
         limit = payload["limit"]
+        # Tokens issued before streaming formats existed carry neither field
+        format = payload.get("format", "xlsx")
+        compress = payload.get("gzip", False)
     except JWTError | KeyError:
         raise HTTPException(status_code=403, detail="Invalid export token")
 
     if type == "statsExport":
-        return export_statistics(by, limit, db)
+        if format == "xlsx":
+            return export_statistics(by, limit, db)
+        return stream_export(stream_statistics(by, limit), "exported-stats", format, compress)
     elif type == "ordersExport":
-        return export_orders(limit, db)
+        if format == "xlsx":
+            return export_orders(limit, db)
+        return stream_export(stream_orders(limit), "exported-orders", format, compress)
     raise HTTPException(status_code=401, detail="Bad export type")
 
 
-def export_orders(limit: int, db: Session):
-    orders = db.query(Order).filter(Order.createdTime >= (datetime.now(tz=TIME_ZONE) - timedelta(days=limit))).order_by(
-        Order.createdTime.desc()).all()
-
-    output = BytesIO()
-    workbook = xlsxwriter.Workbook(output)
-    ws = workbook.add_worksheet("Orders")
-    ws.write(0, 0, "ID")
-    ws.write(0, 1, "Created Time")
-    ws.write(0, 2, "Total Price")
-    ws.write(0, 3, "User ID")
-    ws.write(0, 4, "User Name")
-    ws.write(0, 5, "Status")
-    ws.write(0, 6, "Type")
-    ws.write(0, 7, "Delivery Room")
-    ws.write(0, 8, "Items")
-    ws.write(0, 9, "On-Site Name")
-    ws.write(0, 10, "Paid")
-
-    row = 1
-    for order in orders:
-        ws.write(row, 0, order.id)
-        ws.write(row, 1, order.createdTime.strftime("%Y-%m-%d %H:%M:%S"))
-        ws.write(row, 2, str(order.totalPrice))
-        ws.write(row, 3, order.userId if order.userId is not None else "On-Site Ordering")
-        ws.write(row, 4, order.user.name if order.userId is not None else "On-Site Ordering")
-        ws.write(row, 5, {
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson"
+}
+STATS_EXPORT_COLUMNS = ["Time", "Total Revenue", "Orders", "Cups", "Unique Users"]
+ORDER_EXPORT_COLUMNS = ["ID", "Created Time", "Total Price", "User ID", "User Name", "Status", "Type",
+                        "Delivery Room", "Items", "On-Site Name", "Paid"]
+
+
+def order_export_row(order: Order):
+    items = []
+    for item in order.items:
+        options = []
+        for option in item.appliedOptions:
+            options.append(option.type.name + ": " + option.name)
+        items.append(f"{item.amount}x {item.itemType.name} ({', '.join(options)})")
+    return [
+        order.id,
+        order.createdTime.strftime("%Y-%m-%d %H:%M:%S"),
+        str(order.totalPrice),
+        order.userId if order.userId is not None else "On-Site Ordering",
+        order.user.name if order.userId is not None else "On-Site Ordering",
+        {
             OrderStatus.waiting: "Waiting",
             OrderStatus.done: "Done"
-        }[order.status])
-        ws.write(row, 6, {
+        }[order.status],
+        {
             OrderType.pickUp: "Pick Up",
             OrderType.delivery: "Delivery"
-        }[order.type])
-        ws.write(row, 7, order.deliveryRoom if order.type == OrderType.delivery else "N/A")
-        items = []
-        for item in order.items:
-            options = []
-            for option in item.appliedOptions:
-                options.append(option.type.name + ": " + option.name)
-            items.append(f"{item.amount}x {item.itemType.name} ({', '.join(options)})")
-        ws.write(row, 8, "\n".join(items))
-        ws.write(row, 9, order.onSiteName if order.onSiteName is not None else "N/A")
-        ws.write(row, 10, "Yes" if order.paid else "No")
-        row += 1
-    workbook.close()
-    return Response(
-        output.getvalue(),
+        }[order.type],
+        order.deliveryRoom if order.type == OrderType.delivery else "N/A",
+        "\n".join(items),
+        order.onSiteName if order.onSiteName is not None else "N/A",
+        "Yes" if order.paid else "No"
+    ]
+
+
+def stream_orders(limit: int):
+    # Opens its own session: the request's one is closed before a streaming body starts being sent
+    yield ORDER_EXPORT_COLUMNS
+    with database.ind_db() as db:
+        for order in crud.iter_orders_since(db, datetime.now(tz=TIME_ZONE) - timedelta(days=limit)):
+            yield order_export_row(order)
+
+
+def stream_statistics(by: str, limit: int):
+    yield STATS_EXPORT_COLUMNS
+    with database.ind_db() as db:
+        stats = get_statistics(by, limit, db)
+    for bucket, orders in stats.orders.items():
+        revenue = stats.revenue.get(bucket)
+        yield [bucket, str(revenue) if revenue is not None else None, orders, stats.cups.get(bucket, 0),
+               stats.uniqueUsers.get(bucket, 0)]
+
+
+def encode_rows(rows, format: str, chunk_size: int = 64 * 1024):
+    # The first row is the header, used as the CSV header line or as the NDJSON keys
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    columns = None
+    for row in rows:
+        if format == "csv":
+            writer.writerow(row)
+        elif columns is None:
+            columns = row
+            continue
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(rows, name: str, format: str, compress: bool):
+    chunks = encode_rows(rows, format)
+    filename = f"{name}.{format}"
+    media_type = EXPORT_FORMATS[format]
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f"inline; filename=\"{filename}\""
+    })
+
+
+def stream_file(path: str, chunk_size: int = 64 * 1024):
+    try:
+        with open(path, "rb") as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def export_orders(limit: int, db: Session):
+    # constant_memory flushes each row to a temp file as soon as the next one starts,
+    # so neither the orders nor the workbook are ever held in memory as a whole
+    output = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    output.close()
+    try:
+        workbook = xlsxwriter.Workbook(output.name, {"constant_memory": True, "tmpdir": tempfile.gettempdir()})
+        ws = workbook.add_worksheet("Orders")
+        for column, title in enumerate(ORDER_EXPORT_COLUMNS):
+            ws.write(0, column, title)
+
+        row = 1
+        for order in crud.iter_orders_since(db, datetime.now(tz=TIME_ZONE) - timedelta(days=limit)):
+            for column, value in enumerate(order_export_row(order)):
+                ws.write(row, column, value)
+            row += 1
+        workbook.close()
+    except:
+        os.unlink(output.name)
+        raise
+    return StreamingResponse(
+        stream_file(output.name),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={
             "Content-Disposition": "inline; filename=\"exported-orders.xlsx\""
@@ -282,8 +399,19 @@ def export_statistics(by: str, limit: int, db: Session):
     )
 
 
+@router.get("/metrics", response_model=dict)
+def metrics(user: Annotated[UserSnapshot, Depends(get_current_identity)]):
+    if "admin.cms" not in user.permissions:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return {
+        "userCache": user_cache.stats(),
+        "payloadCache": payloads.payload_cache.stats(),
+        "admission": admission.limiter.stats()
+    }
+
+
 @router.get("/statistics", response_model=StatsAggregateSchema)
-def statistics(by: str, user: Annotated[User, Depends(get_current_user)], limit: int = 90, db: Session = Depends(get_db)):
+def statistics(by: str, user: Annotated[UserSnapshot, Depends(get_current_identity)], limit: int = 90, db: Session = Depends(get_db)):
     if "admin.cms" not in user.permissions:
         raise HTTPException(status_code=403, detail="Permission denied")
     return get_statistics(by, limit, db)
@@ -1,53 +1,41 @@
-import base64
 import os
 import urllib.parse
 from datetime import datetime, timezone, timedelta
-from decimal import Decimal
 from typing import Annotated
 
-import requests
+import httpx
 from fastapi import APIRouter, Depends, HTTPException
 from jose import jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette.responses import RedirectResponse
 
-from data.models import User, OrderStatus
+from data.models import User
 from data.schemas import UserSchemaSecure, UserStatisticsSchema, MeCanOrderResultSchema
-from utils import crud
-from utils.dependencies import get_db, get_current_user
+from utils import crud, crud_async, onelogin
+from utils.dependencies import get_db, get_async_db, get_current_user, get_current_identity
+from utils.user_cache import UserSnapshot
 
 router = APIRouter()
 
 
 @router.get("/login/authorize")
-def login_authorize(code: str | None = None, error: str | None = None, db: Session = Depends(get_db)):
+async def login_authorize(code: str | None = None, error: str | None = None, db: AsyncSession | Session = Depends(get_async_db)):
     if error == "access_denied":
         return RedirectResponse(os.environ["FRONTEND_HOST"], status_code=302)
     if code is None:
         return RedirectResponse(os.environ["FRONTEND_HOST"] + "/login/onboarding?error=error", status_code=302)
 
     # Exchange data
-    r = requests.post(os.environ["ONELOGIN_HOST"] + "/oauth2/token", {
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": os.environ["API_HOST"] + "/login/authorize"
-    }, headers={
-        "Authorization": "Basic " + base64.b64encode((os.environ["ONELOGIN_CLIENT_ID"] + ":" + os.environ["ONELOGIN_CLIENT_SECRET"]).encode("utf-8")).decode("utf-8")
-    })
-
-    data = r.json()
-    if "error" in data:
+    try:
+        data = await onelogin.exchange_code(code)
+        if "error" in data:
+            return RedirectResponse(os.environ["FRONTEND_HOST"] + "/login/onboarding?error=error", status_code=302)
+        data = await onelogin.get_me(data["access_token"])
+    except (httpx.HTTPError, ValueError):
         return RedirectResponse(os.environ["FRONTEND_HOST"] + "/login/onboarding?error=error", status_code=302)
-    access_token = data["access_token"]
 
-    r = requests.get(os.environ["ONELOGIN_HOST"] + "/api/v1/me",
-                     headers={"Authorization": "Bearer " + access_token})
-    data = r.json()
-
-    if crud.get_user(db, data["schoolId"]) is None:
-        user = crud.create_user(db, data["schoolId"], data["name"], data["pinyin"], data.get("phone"))
-    else:
-        user = crud.update_user(db, crud.get_user(db, data["schoolId"]), data["name"], data.get("pinyin"), data.get("phone"))
+    user = await crud_async.upsert_user(db, data["schoolId"], data["name"], data.get("pinyin"), data.get("phone"))
     to_encode = {"name": data["name"], "id": data["schoolId"], "permissions": user.permissions,
                  "exp": datetime.now(timezone.utc) + timedelta(days=30)}
     encoded = jwt.encode(to_encode, key=os.environ["JWT_SECRET_KEY"], algorithm="HS256")
@@ -63,16 +51,16 @@ def me(user: Annotated[User, Depends(get_current_user)]):
 
 
 @router.get("/me/can-order", response_model=MeCanOrderResultSchema)
-def me_can_order(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
-    for o in crud.get_orders_by_user(db, user.id):
-        if o.status != OrderStatus.done or not o.paid:
-            return MeCanOrderResultSchema(
-                result=False,
-                orderId=o.id,
-                orderNumber=o.number,
-                orderTotalPrice=o.totalPrice,
-                orderDate=o.createdTime
-            )
+def me_can_order(user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
+    o = crud.get_active_order(db, user.id)
+    if o is not None:
+        return MeCanOrderResultSchema(
+            result=False,
+            orderId=o.id,
+            orderNumber=o.number,
+            orderTotalPrice=o.totalPrice,
+            orderDate=o.createdTime
+        )
     return MeCanOrderResultSchema(
         result=True,
         orderId=None,
@@ -83,25 +71,15 @@ def me_can_order(user: Annotated[User, Depends(get_current_user)], db: Session =
 
 
 @router.get("/me/statistics", response_model=UserStatisticsSchema)
-def me_statistics(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
+def me_statistics(user: Annotated[UserSnapshot, Depends(get_current_identity)], db: Session = Depends(get_db)):
     if user.blocked:
         raise HTTPException(status_code=403, detail='User is blocked')
-    orders = crud.get_orders_by_user(db, user.id)
-    orders_amount = len(orders)
-    total_spent = Decimal(0)
-    total_cups = 0
-    deletable = True
-    for order in orders:
-        total_spent += order.totalPrice
-        for item in order.items:
-            total_cups += item.amount
-        if not order.paid:
-            deletable = False
+    totals = crud.ensure_not_none(crud.get_user(db, user.id))
     return UserStatisticsSchema(
-        totalOrders=orders_amount,
-        totalSpent=total_spent,
-        totalCups=total_cups,
-        deletable=deletable
+        totalOrders=totals.totalOrders,
+        totalSpent=totals.totalSpent,
+        totalCups=totals.totalCups,
+        deletable=not crud.has_unpaid_order(db, user_id=user.id)
     )
 
 
@@ -109,9 +87,7 @@ def me_statistics(user: Annotated[User, Depends(get_current_user)], db: Session
 def delete_me(user: Annotated[User, Depends(get_current_user)], db: Session = Depends(get_db)):
     if user.blocked:
         raise HTTPException(status_code=403, detail='Cannot delete blocked user')
-    orders = crud.get_orders_by_user(db, user.id)
-    for order in orders:
-        if not order.paid:
-            raise HTTPException(status_code=403, detail='Cannot delete user with active orders')
+    if crud.has_unpaid_order(db, user_id=user.id):
+        raise HTTPException(status_code=403, detail='Cannot delete user with active orders')
     crud.delete_user(db, user)
     return True
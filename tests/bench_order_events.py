@@ -0,0 +1,182 @@
+# Order estimate updates pushed over /order/events vs clients polling /order/estimate.
+# Usage: python tests/bench_order_events.py [--subscribers 50] [--changes 20] [--every 0.25] [--interval 2]
+# N customers each watch their own waiting order while staff completes the oldest orders one by one. Reports how many
+# requests the customers sent in total and how long after each completion they saw their new place in the queue.
+# The app runs under uvicorn on a local port: httpx's ASGI transport buffers whole responses, so it can't stream SSE.
+# Each mode runs in its own process on a fresh SQLite database.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ["events", "poll"]
+
+
+def setup(subscribers: int):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "whale.db")
+    os.environ["API_HOST"] = "http://localhost:8000"
+    os.environ["JWT_SECRET_KEY"] = "secret"
+    sys.path.insert(0, ROOT)
+
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import text
+    from data.database import SessionLocal
+    from data.models import Category, ItemType, OptionItem, OptionType, Order, OrderedItem, OrderStatus, OrderType, \
+        User
+    from utils import crud
+    from utils.dependencies import TIME_ZONE
+
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    command.upgrade(config, "head")
+    db = SessionLocal()
+    size = OptionType(name="Size")
+    small = OptionItem(name="Small", type=size, priceChange=Decimal("0"), isDefault=True)
+    db.add(ItemType(category=Category(name="Coffee"), name="Latte", description="", shortDescription="",
+                    options=[size], basePrice=Decimal("10"), salePercent=Decimal("1")))
+    db.add(User(id="staff", name="Staff", pinyin="staff", permissions="admin.manage", points=0))
+    db.commit()
+    db.execute(text("UPDATE itemtypes SET image = 'coffee.png'"))
+    # Order k (id k + 1) has k orders ahead of it
+    started = datetime.datetime.now(tz=TIME_ZONE) - datetime.timedelta(hours=1)
+    for index in range(subscribers):
+        created = started + datetime.timedelta(seconds=index)
+        db.add(Order(status=OrderStatus.waiting, createdTime=created, businessDate=crud.get_business_date(created),
+                     type=OrderType.pickUp, paid=False, totalPrice=Decimal("10.00"), number=str(100 + index),
+                     items=[OrderedItem(itemTypeId=1, amount=1, appliedOptions=[small])]))
+    db.commit()
+    db.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run(mode: str, subscribers: int, changes: int, every: float, interval: float):
+    import httpx
+    import uvicorn
+    from jose import jwt
+    from utils import admission, ratelimit
+    import main
+
+    class Unlimited(ratelimit.Backend):
+        # Every customer connects from 127.0.0.1, the per-IP estimate limit would throttle the polling clients
+        def take(self, key: str, rate: float, burst: int) -> float:
+            return 0
+
+    ratelimit.backend = Unlimited()
+    # Measures the notification path, not load shedding
+    for route_class in admission.limiter.classes.values():
+        route_class.limit = route_class.minimum = route_class.maximum = subscribers * 2
+    admission.limiter.max_in_flight = subscribers * 10
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="off"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    headers = {"Authorization": "Bearer " + jwt.encode({"id": "staff", "exp": expires}, "secret", "HS256")}
+    changed_at = {}
+    delays = []
+    requests = 0
+    stop = asyncio.Event()
+
+    def observed(index: int, estimate: dict):
+        # Subscriber `index` seeing `orders` ahead has caught up with the completion of order index - orders
+        change = index - estimate["orders"] - 1
+        if estimate["status"] == "waiting" and change in changed_at:
+            delays.append(time.perf_counter() - changed_at[change])
+
+    async def listen(client: httpx.AsyncClient, index: int):
+        nonlocal requests
+        requests += 1
+        async with client.stream("GET", "/order/events", params={"id": index + 1}) as response:
+            last = None
+            async for line in response.aiter_lines():
+                if line.startswith("data: ") and line != last:
+                    last = line
+                    observed(index, json.loads(line[6:]))
+
+    async def poll(client: httpx.AsyncClient, index: int):
+        nonlocal requests
+        last = None
+        # Spread over the interval, like clients that opened the page at different times
+        await asyncio.sleep(interval * index / subscribers)
+        while not stop.is_set():
+            requests += 1
+            estimate = (await client.get("/order/estimate", params={"id": index + 1})).json()
+            if estimate != last:
+                last = estimate
+                observed(index, estimate)
+            if estimate["status"] == "done":
+                return
+            await asyncio.sleep(interval)
+
+    limits = httpx.Limits(max_connections=subscribers + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        subscribe = listen if mode == "events" else poll
+        tasks = [asyncio.create_task(subscribe(client, index)) for index in range(subscribers)]
+        # Lets every subscriber connect and see its starting position
+        await asyncio.sleep(max(1.0, interval if mode == "poll" else 0))
+        for change in range(changes):
+            changed_at[change] = time.perf_counter()
+            response = await client.patch("/order", json={"id": change + 1, "status": "done", "paid": None},
+                                          headers=headers)
+            assert response.status_code == 200, response.text
+            await asyncio.sleep(every)
+        # Time for the slowest poller to come around once more
+        await asyncio.sleep(interval if mode == "poll" else 1.0)
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    server.should_exit = True
+    await serving
+
+    # Every completion moves each order behind it up by one
+    expected = sum(subscribers - change - 1 for change in range(changes))
+    delays.sort()
+    return {
+        "requests": requests,
+        "updates seen": f"{len(delays)}/{expected}",
+        "p50 ms": round(statistics.median(delays) * 1000, 1) if delays else None,
+        "p95 ms": round(delays[int(len(delays) * 0.95) - 1] * 1000, 1) if delays else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--changes", type=int, default=20)
+    parser.add_argument("--every", type=float, default=0.25, help="seconds between two completed orders")
+    parser.add_argument("--interval", type=float, default=2.0, help="polling interval in seconds")
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+    if args.mode is None:
+        for mode in MODES:
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--subscribers", str(args.subscribers),
+                            "--changes", str(args.changes), "--every", str(args.every),
+                            "--interval", str(args.interval)], check=True)
+        return
+    setup(args.subscribers)
+    result = asyncio.run(run(args.mode, args.subscribers, args.changes, args.every, args.interval))
+    print(args.mode.ljust(6), "  ".join(f"{key} {value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
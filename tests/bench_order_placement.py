@@ -0,0 +1,119 @@
+# Sync vs async database mode under concurrent order placement.
+# Usage: python tests/bench_order_placement.py [--orders 300] [--concurrency 50]
+# Each mode runs in its own process on a fresh SQLite database, since the engine is chosen from DATABASE_URL on import.
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "sync": "sqlite:///{}",
+    "async": "sqlite+aiosqlite:///{}"
+}
+
+
+def setup(mode: str):
+    os.environ["DATABASE_URL"] = MODES[mode].format(os.path.join(tempfile.mkdtemp(), "whale.db"))
+    os.environ["API_HOST"] = "http://localhost:8000"
+    os.environ["JWT_SECRET_KEY"] = "secret"
+    sys.path.insert(0, ROOT)
+
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import text
+    from data.database import SessionLocal
+    from data.models import Category, ItemType, OptionItem, OptionType, User
+
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    command.upgrade(config, "head")
+    db = SessionLocal()
+    size = OptionType(name="Size")
+    db.add(OptionItem(name="Small", type=size, priceChange=Decimal("0"), isDefault=True))
+    db.add(ItemType(category=Category(name="Coffee"), name="Latte", description="", shortDescription="",
+                    options=[size], basePrice=Decimal("10"), salePercent=Decimal("1")))
+    db.commit()
+    db.execute(text("UPDATE itemtypes SET image = 'coffee.png'"))
+    db.commit()
+    db.close()
+
+
+async def place_orders(orders: int, concurrency: int):
+    import httpx
+    from jose import jwt
+    from data import database
+    from data.database import SessionLocal
+    from data.models import User
+    from utils import admission
+    import main
+
+    db = SessionLocal()
+    # One customer per order, a customer with an unpaid order can't place another
+    db.add_all([User(id=f"b{index}", name=f"Bench {index}", permissions="", points=0) for index in range(orders + 1)])
+    db.commit()
+    db.close()
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    tokens = [jwt.encode({"id": f"b{index}", "exp": expires}, "secret", "HS256") for index in range(orders + 1)]
+    body = {"type": "pickUp", "deliveryRoom": None, "items": [{"itemType": 1, "appliedOptions": [1], "amount": 1}],
+            "onSiteOrder": False, "onSiteName": None}
+    # Measures the database path, not load shedding: pins the orders limit so it can't adapt down
+    orders_class = admission.limiter.classes["orders"]
+    orders_class.limit = orders_class.minimum = orders_class.maximum = admission.limiter.max_in_flight = concurrency
+
+    # Errors come back as 500s and count as failures instead of aborting the run
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warms the catalog, settings and connection pool
+        await client.post("/order", json=body, headers={"Authorization": "Bearer " + tokens[orders]})
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def place(index: int):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/order", json=body, headers={"Authorization": "Bearer " + tokens[index]})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[place(index) for index in range(orders)])
+        elapsed = time.perf_counter() - started
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+    latencies.sort()
+    return {
+        "orders/s": round(orders / elapsed, 1),
+        "p50 ms": round(statistics.median(latencies) * 1000, 1),
+        "p95 ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "failed": failures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=list(MODES))
+    args = parser.parse_args()
+    if args.mode is None:
+        for mode in MODES:
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--orders", str(args.orders),
+                            "--concurrency", str(args.concurrency)], check=True)
+        return
+    setup(args.mode)
+    result = asyncio.run(place_orders(args.orders, args.concurrency))
+    print(args.mode.ljust(6), "  ".join(f"{key} {value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
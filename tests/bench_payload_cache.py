@@ -0,0 +1,142 @@
+# Throughput of the two hottest polled reads, /items and /orders/today, with and without the payload cache.
+# Usage: python tests/bench_payload_cache.py [--requests 500] [--concurrency 10] [--orders 200]
+# "uncached" hands the route result back to FastAPI's response_model serialization, as before the cache existed.
+# Each mode runs in its own process on a fresh SQLite database.
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ["cached", "uncached"]
+PATHS = ["/items", "/orders/today"]
+
+
+def setup(orders: int):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "whale.db")
+    os.environ["API_HOST"] = "http://localhost:8000"
+    os.environ["JWT_SECRET_KEY"] = "secret"
+    sys.path.insert(0, ROOT)
+
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import text
+    from data.database import SessionLocal
+    from data.models import Category, ItemType, OptionItem, OptionType, Order, OrderedItem, OrderStatus, OrderType, \
+        User
+    from utils import crud
+    from utils.dependencies import TIME_ZONE
+
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    command.upgrade(config, "head")
+    db = SessionLocal()
+    size = OptionType(name="Size")
+    small = OptionItem(name="Small", type=size, priceChange=Decimal("0"), isDefault=True)
+    big = OptionItem(name="Big", type=size, priceChange=Decimal("2"), isDefault=False)
+    # A menu about the size of the real one
+    for category_index in range(4):
+        category = Category(name=f"Category {category_index}")
+        for index in range(8):
+            db.add(ItemType(category=category, name=f"Item {category_index}-{index}", description="A drink " * 20,
+                            shortDescription="A drink", options=[size], basePrice=Decimal("10"),
+                            salePercent=Decimal("1")))
+    db.add(User(id="staff", name="Staff", pinyin="staff", permissions="admin.manage", points=0))
+    db.add_all([User(id=f"b{index}", name=f"Bench {index}", pinyin=f"bench{index}", permissions="", points=0)
+                for index in range(orders)])
+    db.commit()
+    db.execute(text("UPDATE itemtypes SET image = 'coffee.png'"))
+    now = datetime.datetime.now(tz=TIME_ZONE)
+    for index in range(orders):
+        created = now - datetime.timedelta(seconds=index)
+        order = Order(status=OrderStatus.waiting if index % 3 else OrderStatus.done, createdTime=created,
+                      businessDate=crud.get_business_date(created), type=OrderType.pickUp, userId=f"b{index}",
+                      paid=False, totalPrice=Decimal("22.00"), number=str(100 + index))
+        order.items = [OrderedItem(itemTypeId=index % 32 + 1, amount=1, appliedOptions=[small]),
+                       OrderedItem(itemTypeId=(index + 7) % 32 + 1, amount=1, appliedOptions=[big])]
+        db.add(order)
+    db.commit()
+    db.close()
+
+
+def bypass_payload_cache():
+    # The route returns the objects themselves, so response_model validates and encodes them on every request
+    from utils import payloads
+
+    def respond(key, build, schema, response=None):
+        return build()
+
+    payloads.payload_cache.respond = respond
+
+
+async def run_requests(path: str, requests: int, concurrency: int):
+    import httpx
+    from jose import jwt
+    from utils import admission
+    import main
+
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    headers = {"Authorization": "Bearer " + jwt.encode({"id": "staff", "exp": expires}, "secret", "HS256")}
+    # Measures serialization, not load shedding: reads only get part of max_in_flight, so that is lifted too
+    reads = admission.limiter.classes["reads"]
+    reads.limit = reads.minimum = reads.maximum = concurrency
+    admission.limiter.max_in_flight = concurrency * 10
+
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warms the catalog, the identity cache and, when enabled, the payload cache
+        size = len((await client.get(path, headers=headers)).content)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def get():
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[get() for _ in range(requests)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "req/s": round(requests / elapsed, 1),
+        "p50 ms": round(statistics.median(latencies) * 1000, 2),
+        "p95 ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "KB": round(size / 1024, 1),
+        "failed": failures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+    if args.mode is None:
+        for mode in MODES:
+            subprocess.run([sys.executable, __file__, "--mode", mode, "--requests", str(args.requests),
+                            "--concurrency", str(args.concurrency), "--orders", str(args.orders)], check=True)
+        return
+    setup(args.orders)
+    if args.mode == "uncached":
+        bypass_payload_cache()
+    for path in PATHS:
+        result = asyncio.run(run_requests(path, args.requests, args.concurrency))
+        print(args.mode.ljust(8), path.ljust(13), "  ".join(f"{key} {value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
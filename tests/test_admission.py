@@ -0,0 +1,125 @@
+import pytest
+from starlette.responses import JSONResponse
+from starlette.testclient import TestClient
+
+from utils import admission
+from utils.admission import AdmissionLimiter, AdmissionMiddleware, RouteClass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utils.admission.time.monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def limiter():
+    return AdmissionLimiter([
+        RouteClass("orders", priority=0, target=1.0, initial=4, minimum=2, maximum=5),
+        RouteClass("reads", priority=1, target=0.25, initial=10, minimum=2, maximum=20),
+        RouteClass("admin", priority=2, target=5.0, initial=10, minimum=1, maximum=10)
+    ], max_in_flight=10)
+
+
+def test_limit_grows_additively_while_in_use(clock):
+    route_class = RouteClass("orders", priority=0, target=1.0, initial=4, minimum=2, maximum=5)
+    route_class.in_flight = 2
+    route_class.completed(0.1, False)
+    assert route_class.limit == 4.25
+    for _ in range(10):
+        route_class.completed(0.1, False)
+    assert route_class.limit == 5
+
+
+def test_limit_does_not_grow_while_idle(clock):
+    route_class = RouteClass("orders", priority=0, target=1.0, initial=4, minimum=2, maximum=5)
+    route_class.completed(0.1, False)
+    assert route_class.limit == 4
+
+
+@pytest.mark.parametrize("latency,failed", [(1.5, False), (0.1, True)])
+def test_limit_shrinks_once_per_target_interval(clock, latency, failed):
+    route_class = RouteClass("orders", priority=0, target=1.0, initial=4, minimum=2, maximum=5)
+    route_class.completed(latency, failed)
+    assert route_class.limit == pytest.approx(3.2)
+    # The rest of the same slow burst doesn't count again
+    route_class.completed(latency, failed)
+    assert route_class.limit == pytest.approx(3.2)
+    clock[0] += 1
+    route_class.completed(latency, failed)
+    assert route_class.limit == pytest.approx(2.56)
+    for _ in range(5):
+        clock[0] += 1
+        route_class.completed(latency, failed)
+    assert route_class.limit == 2
+
+
+def test_lower_priorities_only_get_part_of_the_shared_capacity(limiter):
+    admin, reads, orders = limiter.classes["admin"], limiter.classes["reads"], limiter.classes["orders"]
+    # Admin may use 30% of the 10 shared slots even though its own limit is 10
+    assert [limiter.acquire(admin) for _ in range(4)] == [True, True, True, False]
+    # Reads may fill up to 60%
+    assert [limiter.acquire(reads) for _ in range(4)] == [True, True, True, False]
+    # Orders keep the headroom, up to their own limit of 4
+    assert [limiter.acquire(orders) for _ in range(5)] == [True, True, True, True, False]
+    assert (admin.rejected, reads.rejected, orders.rejected) == (1, 1, 1)
+    assert limiter.in_flight == 10
+
+    limiter.release(orders, 0.1, False)
+    assert (orders.in_flight, limiter.in_flight) == (3, 9)
+
+
+@pytest.mark.parametrize("method,path,route_class", [
+    ("POST", "/order", "orders"),
+    ("PATCH", "/order", "orders"),
+    ("DELETE", "/order", "orders"),
+    ("GET", "/order", "reads"),
+    ("GET", "/items", "reads"),
+    ("GET", "/statistics", "admin"),
+    ("GET", "/statistics/export", "admin"),
+    ("GET", "/orders/all/cursor", "admin"),
+    ("GET", "/admin/user/list", "admin"),
+    ("GET", "/order/events", None),
+    ("GET", "/metrics", None),
+    ("GET", "/uploads/coffee.png", None)
+])
+def test_classify(limiter, method, path, route_class):
+    result = limiter.classify(method, path)
+    assert (result.name if result is not None else None) == route_class
+
+
+def test_middleware_sheds_over_limit_and_learns_latency(clock, limiter):
+    latencies = {"/items": 0.5, "/order": 0.1}
+
+    async def app(scope, receive, send):
+        # Stands in for the routes, taking as long as the path says on the fake clock
+        clock[0] += latencies[scope["path"]]
+        await JSONResponse(scope["path"])(scope, receive, send)
+
+    client = TestClient(AdmissionMiddleware(app, limiter))
+    reads = limiter.classes["reads"]
+    assert client.get("/items").status_code == 200
+    # Over the 0.25 s target for reads
+    assert reads.limit == 8
+    assert reads.latency == 0.5
+
+    reads.in_flight = 8
+    response = client.get("/items")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert response.json() == {"detail": "Server busy"}
+    assert reads.rejected == 1
+    # Another class is still admitted
+    assert client.post("/order").status_code == 200
+
+
+def test_app_returns_503_when_reads_are_saturated(client, monkeypatch):
+    reads = admission.limiter.classes["reads"]
+    monkeypatch.setattr(reads, "in_flight", int(reads.limit))
+    monkeypatch.setattr(reads, "rejected", reads.rejected)
+    response = client.get("/items")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    # Order placement is a different class and still gets through to its own checks
+    assert client.post("/order", json={}).status_code != 503
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/items", "/items?category=1", "/item?id=1", "/categories", "/pms"])
+def test_catalog_answers_conditional_get(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public")
+    assert response.headers["content-type"] == "application/json"
+
+    cached = client.get(path, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert cached.content == b""
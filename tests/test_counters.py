@@ -0,0 +1,26 @@
+import datetime
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import mysql
+
+from data.models import DailyCounter
+from utils import crud
+
+
+def test_insert_ignore_keeps_existing_row(db):
+    day = datetime.date(2001, 1, 1)
+    crud.insert_ignore(db, DailyCounter, businessDate=day, onlineCups=3, onSiteCups=4, lastNumber=5, lastChange=6)
+    db.commit()
+    crud.insert_ignore(db, DailyCounter, businessDate=day, onlineCups=0, onSiteCups=0, lastNumber=0, lastChange=0)
+    db.commit()
+    counter = db.get(DailyCounter, day)
+    assert (counter.onlineCups, counter.onSiteCups, counter.lastNumber, counter.lastChange) == (3, 4, 5, 6)
+
+
+def test_insert_ignore_on_mysql_only_reassigns_the_key():
+    # Not run against MySQL here, so check the statement it would send
+    statements = []
+    session = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=mysql.dialect()), execute=statements.append)
+    crud.insert_ignore(session, DailyCounter, businessDate=datetime.date(2001, 1, 1), onlineCups=0)
+    sql = str(statements[0].compile(dialect=mysql.dialect()))
+    assert sql.endswith("ON DUPLICATE KEY UPDATE `businessDate` = dailycounters.`businessDate`"), sql
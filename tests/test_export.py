@@ -0,0 +1,35 @@
+import csv
+import datetime
+import functools
+import io
+
+from sqlalchemy import func, select
+
+from conftest import add_order, add_user, auth
+from data.models import Order
+from utils import crud
+from utils.dependencies import TIME_ZONE
+
+BATCH_SIZE = 7
+
+
+def test_orders_export_spans_batches(client, db, monkeypatch):
+    add_user(db, "exporter")
+    now = datetime.datetime.now(tz=TIME_ZONE).replace(microsecond=0)
+    # Several orders per timestamp, so batches also break between orders created in the same second
+    for index in range(BATCH_SIZE * 3 + 2):
+        add_order(db, "exporter", now - datetime.timedelta(hours=index // 4))
+    monkeypatch.setattr(crud, "iter_orders_since", functools.partial(crud.iter_orders_since, batch_size=BATCH_SIZE))
+    since = datetime.datetime.now(tz=TIME_ZONE) - datetime.timedelta(days=3)
+    expected = db.scalar(select(func.count()).select_from(Order).where(Order.createdTime >= since))
+    assert expected > BATCH_SIZE * 3
+
+    token = client.get("/statistics/export/token", params={"type": "ordersExport", "by": "day", "limit": 3,
+                                                           "format": "csv"}, headers=auth("admin")).json()
+    response = client.get("/statistics/export", params={"token": token})
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))[1:]
+    assert len(rows) == expected
+    ids = [int(row[0]) for row in rows]
+    assert len(set(ids)) == expected
+    assert [row[1] for row in rows] == sorted((row[1] for row in rows), reverse=True)
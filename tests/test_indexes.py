@@ -0,0 +1,52 @@
+import re
+
+import pytest
+
+from conftest import capture_queries
+from data.database import engine
+from utils import crud
+from utils.order_queue import OrderQueue
+
+
+# EXPLAIN QUERY PLAN and its SCAN/SEARCH output are SQLite's, MySQL would need EXPLAIN and a different check
+pytestmark = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="checks SQLite query plans")
+
+
+def query_plans(db, run):
+    # EXPLAIN QUERY PLAN of every statement run() sends to the database that reads the orders table
+    with capture_queries() as queries:
+        run()
+    plans = []
+    for statement, parameters in queries:
+        if statement.lstrip().startswith("SELECT") and re.search(r"\sFROM orders\b", statement):
+            rows = db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            plans.append([row[-1] for row in rows])
+    assert plans
+    return plans
+
+
+def assert_uses_index(plans, index: str):
+    for plan in plans:
+        details = " | ".join(plan)
+        assert "SCAN orders" not in details, details
+        assert f"INDEX {index}" in details, details
+
+
+def test_user_history_uses_index(db):
+    plans = query_plans(db, lambda: db.scalars(crud.get_orders_query_by_user("customer").limit(20)).all())
+    assert_uses_index(plans[:1], "ix_orders_userId_createdTime")
+
+
+def test_staff_board_uses_index(db):
+    plans = query_plans(db, lambda: OrderQueue().rebuild(db))
+    assert_uses_index(plans, "ix_orders_status_createdTime")
+
+
+@pytest.mark.parametrize("index,statement", [
+    ("ix_orders_businessDate_number", 0),
+    ("ix_orders_number_createdTime", 1)
+])
+def test_number_lookup_uses_index(db, index, statement):
+    # A number nobody has today runs both lookups, today's and the fallback to the latest day that used it
+    plans = query_plans(db, lambda: crud.get_order_by_number(db, "none"))
+    assert_uses_index(plans[statement:statement + 1], index)
@@ -0,0 +1,80 @@
+import urllib.parse
+
+import httpx
+import pytest
+from jose import jwt
+
+from data.models import User
+from utils import onelogin
+
+
+def fake_onelogin(token_response, me_response=None):
+    # Stands in for OneLogin behind the shared client, records what the app sent
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.url.path == "/oauth2/token":
+            return token_response(request) if callable(token_response) else token_response
+        if request.url.path == "/api/v1/me":
+            return me_response(request) if callable(me_response) else me_response
+        return httpx.Response(404)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), requests
+
+
+@pytest.fixture
+def login(client, monkeypatch):
+    def login(token_response, me_response=None):
+        fake, requests = fake_onelogin(token_response, me_response)
+        monkeypatch.setattr(onelogin, "_client", fake)
+        response = client.get("/login/authorize", params={"code": "abc"}, follow_redirects=False)
+        return response, requests
+
+    return login
+
+
+def times_out(error):
+    def respond(request: httpx.Request):
+        raise error("timed out", request=request)
+
+    return respond
+
+
+def redirect_params(response):
+    assert response.status_code == 302
+    location = urllib.parse.urlsplit(response.headers["location"])
+    assert location.path == "/login/onboarding"
+    return urllib.parse.parse_qs(location.query)
+
+
+def test_login_exchanges_code_and_upserts_user(login, db):
+    response, requests = login(
+        httpx.Response(200, json={"access_token": "onelogin-token"}),
+        httpx.Response(200, json={"schoolId": "newcomer", "name": "Newcomer", "pinyin": "xinren", "phone": None})
+    )
+    params = redirect_params(response)
+    token = jwt.decode(params["token"][0], "secret", algorithms=["HS256"])
+    assert (token["id"], token["name"], params["name"][0]) == ("newcomer", "Newcomer", "Newcomer")
+    assert response.cookies["token"] == params["token"][0]
+
+    exchange, me = requests
+    assert exchange.method == "POST" and urllib.parse.parse_qs(exchange.content.decode())["code"] == ["abc"]
+    assert exchange.headers["authorization"].startswith("Basic ")
+    assert me.headers["authorization"] == "Bearer onelogin-token"
+    user = db.get(User, "newcomer")
+    assert (user.name, user.pinyin) == ("Newcomer", "xinren")
+
+
+@pytest.mark.parametrize("token_response,me_response", [
+    (httpx.Response(400, json={"error": "invalid_grant"}), None),
+    (httpx.Response(502, text="Bad gateway"), None),
+    (httpx.Response(200, text="<html>"), None),
+    (httpx.Response(200, json={"access_token": "onelogin-token"}), httpx.Response(401, json={"message": "expired"})),
+    (httpx.Response(200, json={"access_token": "onelogin-token"}), times_out(httpx.ReadTimeout)),
+    (times_out(httpx.ConnectTimeout), None)
+], ids=["rejected-code", "token-502", "token-not-json", "me-401", "me-timeout", "token-timeout"])
+def test_login_failures_redirect_with_error(login, token_response, me_response):
+    response, _ = login(token_response, me_response)
+    assert redirect_params(response) == {"error": ["error"]}
+    assert "token" not in response.cookies
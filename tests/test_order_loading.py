@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+
+from conftest import add_order, add_user, auth, capture_queries
+from data.database import SessionLocal
+from utils.dependencies import TIME_ZONE
+
+
+@pytest.fixture(scope="module")
+def history(database):
+    db = SessionLocal()
+    add_user(db, "loyal")
+    start = datetime.datetime.now(tz=TIME_ZONE) - datetime.timedelta(days=60)
+    for day in range(60):
+        add_order(db, "loyal", start + datetime.timedelta(days=day), cups=(1, 2, 1), paid=True)
+    db.close()
+
+
+@pytest.mark.parametrize("path,user", [
+    ("/orders", "loyal"),
+    ("/orders/cursor", "loyal"),
+    ("/orders/all", "admin"),
+    ("/orders/all/cursor", "admin")
+])
+def test_page_cost_does_not_depend_on_page_size(client, history, path, user):
+    # One token for every request, warmed first, so the identity lookup is cached for both pages
+    headers = auth(user)
+    assert client.get(path, params={"size": 1}, headers=headers).status_code == 200
+    costs = {}
+    for size in (1, 50):
+        with capture_queries() as queries:
+            response = client.get(path, params={"size": size}, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()["items"]) == size
+        costs[size] = len(queries)
+    assert costs[1] == costs[50]
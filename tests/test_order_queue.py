@@ -0,0 +1,24 @@
+import datetime
+
+from conftest import add_order, add_user
+from data.models import OrderStatus
+from utils import order_queue, scheduling
+from utils.dependencies import TIME_ZONE
+
+
+def test_scheduled_rebuild_picks_up_outside_writes(db):
+    add_user(db, "queued")
+    scheduling.rebuild_order_queue()
+    orders, cups = order_queue.queue.totals()
+    # Written past crud, like an edit in the admin panel
+    order = add_order(db, "queued", datetime.datetime.now(tz=TIME_ZONE), cups=(2, 1), status=OrderStatus.waiting)
+    assert order_queue.queue.get(order.id) is None
+
+    scheduling.rebuild_order_queue()
+    assert order_queue.queue.totals() == (orders + 1, cups + 3)
+    assert order_queue.queue.ahead_of(order.id) == (orders, cups)
+
+    order.status = OrderStatus.done
+    db.commit()
+    scheduling.rebuild_order_queue()
+    assert order_queue.queue.totals() == (orders, cups)
@@ -0,0 +1,60 @@
+import pytest
+
+from utils.ratelimit import Backend, MemoryBackend
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utils.ratelimit.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_prune_keeps_buckets_of_slower_scopes(clock):
+    backend = MemoryBackend(max_keys=4)
+    for _ in range(3):
+        assert backend.take("order:user:a", rate=0.2, burst=3) == 0
+    assert backend.take("order:user:a", rate=0.2, burst=3) > 0
+    backend.take("estimate:ip:x", rate=5, burst=30)
+    backend.take("estimate:ip:y", rate=5, burst=30)
+
+    # Long enough for an estimate bucket to refill, far too short for an order bucket
+    clock[0] += 10
+    for client in ("z", "w", "v"):
+        backend.take(f"estimate:ip:{client}", rate=5, burst=30)
+    assert list(backend.buckets) == ["order:user:a", "estimate:ip:z", "estimate:ip:w", "estimate:ip:v"]
+    # Two tokens refilled in 10 s, an evicted bucket would have come back with all three
+    assert backend.take("order:user:a", rate=0.2, burst=3) == 0
+    assert backend.take("order:user:a", rate=0.2, burst=3) == 0
+    assert backend.take("order:user:a", rate=0.2, burst=3) > 0
+
+
+def test_evicts_least_recently_used_when_nothing_refilled(clock):
+    backend = MemoryBackend(max_keys=8)
+    for index in range(8):
+        backend.take(f"order:user:{index}", rate=0.2, burst=3)
+    backend.take("order:user:0", rate=0.2, burst=3)
+    backend.take("order:user:new", rate=0.2, burst=3)
+    # Down to 7 buckets: the two least recently used are gone, the one just used again is kept
+    assert list(backend.buckets) == [f"order:user:{index}" for index in range(3, 8)] + ["order:user:0",
+                                                                                     "order:user:new"]
+
+
+def test_prune_does_not_run_on_every_request_at_the_cap(clock, monkeypatch):
+    backend = MemoryBackend(max_keys=64)
+    scans = []
+    prune = backend.prune
+    monkeypatch.setattr(backend, "prune", lambda now: scans.append(now) or prune(now))
+    for index in range(64 + 90):
+        backend.take(f"estimate:ip:{index}", rate=5, burst=30)
+    assert len(backend.buckets) <= 64
+    # Each scan frees an eighth of max_keys, the first runs at 65 keys and the next every 9 new clients after that
+    assert len(scans) == 10
+
+
+def test_backend_is_abstract():
+    class Incomplete(Backend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
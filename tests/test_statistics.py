@@ -0,0 +1,110 @@
+import datetime
+from decimal import Decimal, localcontext
+
+import pytest
+
+from conftest import add_order, add_user
+from data.models import Order
+from routers import manage
+from utils import crud
+from utils.dependencies import TIME_ZONE
+
+LIMIT = 30
+
+
+def python_statistics(db, by: str):
+    # The loop /statistics used before it moved into SQL, kept as the reference. Sums run with enough precision,
+    # the old module-wide 5 digits rounded them (1999.98 became 2000.0)
+    def get_bucket(order):
+        if by == "individual":
+            return order.createdTime.strftime("%Y-%m-%d %H:%M:%S")
+        if by == "week":
+            return (order.businessDate - datetime.timedelta(days=order.businessDate.weekday())).strftime("%Y-%m-%d")
+        if by == "month":
+            return order.businessDate.strftime("%Y-%m-01")
+        return order.businessDate.strftime("%Y-%m-%d")
+
+    since = datetime.datetime.now(tz=TIME_ZONE) - datetime.timedelta(days=LIMIT)
+    today = crud.get_business_date()
+    start_of_week = today - datetime.timedelta(days=today.weekday())
+    end_of_week = start_of_week + datetime.timedelta(days=6)
+    revenue, orders, cups, users = {}, {}, {}, {}
+    today_revenue, today_orders, today_cups, today_users = Decimal(0), 0, 0, set()
+    week_revenue = Decimal(0)
+    with localcontext() as context:
+        context.prec = 28
+        if by == "individual":
+            window = Order.createdTime >= since.replace(tzinfo=None)
+        else:
+            # The rollup has whole business days, so the window starts at the beginning of the first one
+            window = Order.businessDate >= since.date()
+        for order in db.query(Order).filter(window).all():
+            bucket = get_bucket(order)
+            if order.paid:
+                revenue[bucket] = revenue.get(bucket, Decimal(0)) + order.totalPrice
+            orders[bucket] = orders.get(bucket, 0) + 1
+            cups[bucket] = cups.get(bucket, 0) + sum(item.amount for item in order.items)
+            users.setdefault(bucket, set()).add(order.userId)
+        for order in db.query(Order).filter(Order.businessDate == today).all():
+            if order.paid:
+                today_revenue += order.totalPrice
+            today_orders += 1
+            today_cups += sum(item.amount for item in order.items)
+            today_users.add(order.userId)
+        for order in db.query(Order).filter(Order.businessDate >= start_of_week, Order.businessDate <= end_of_week):
+            week_revenue += order.totalPrice
+    return {
+        "todayRevenue": today_revenue,
+        "todayOrders": today_orders,
+        "todayCups": today_cups,
+        "todayUniqueUsers": len(today_users),
+        "weekRevenue": week_revenue,
+        "weekRevenueRange": f"{start_of_week.strftime('%Y-%m-%d')} - {end_of_week.strftime('%Y-%m-%d')}",
+        "revenue": revenue,
+        "orders": orders,
+        "cups": cups,
+        "uniqueUsers": {bucket: len(bucket_users) for bucket, bucket_users in users.items()}
+    }
+
+
+@pytest.fixture(scope="module")
+def mixed_orders(database):
+    from data.database import SessionLocal
+    db = SessionLocal()
+    for user_id in ("alice", "bob", "carol"):
+        add_user(db, user_id)
+    now = datetime.datetime.now(tz=TIME_ZONE)
+    noon = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    minute = datetime.timedelta(minutes=1)
+    # Today, this week, earlier this month and last month, plus one day outside the window
+    for days, user_id, cups, paid, price in [
+        (0, "alice", (2, 1), True, Decimal("999.99")),
+        (0, "alice", (1,), True, Decimal("999.99")),
+        (0, "bob", (3,), False, Decimal("12.50")),
+        (0, None, (1,), True, Decimal("8.00")),
+        (1, "carol", (1, 1, 1), True, Decimal("999.99")),
+        (1, "bob", (2,), True, Decimal("999.99")),
+        (2, None, (1,), False, Decimal("15.00")),
+        (6, "alice", (4,), True, Decimal("432.10")),
+        (9, "carol", (1,), False, Decimal("999.99")),
+        (9, "carol", (2,), True, Decimal("999.99")),
+        (20, "bob", (1,), True, Decimal("5.55")),
+        (27, None, (5,), True, Decimal("999.99")),
+        (45, "alice", (1,), True, Decimal("999.99"))
+    ]:
+        noon -= minute
+        add_order(db, user_id, noon - datetime.timedelta(days=days), cups=cups, paid=paid, price=price)
+    crud.rebuild_daily_stats(db)
+    db.close()
+
+
+@pytest.mark.parametrize("by", ["day", "week", "month", "individual"])
+def test_statistics_match_python_implementation(db, mixed_orders, monkeypatch, by):
+    monkeypatch.setattr(manage, "stats_cache", {key: None for key in manage.stats_cache})
+    result = manage.get_statistics(by, LIMIT, db)
+    expected = python_statistics(db, by)
+    actual = result.model_dump()
+    for field, value in expected.items():
+        assert actual[field] == value, field
+    # Formatted like todayRevenue, with cents
+    assert all(value.as_tuple().exponent == -2 for value in result.revenue.values())
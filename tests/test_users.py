@@ -0,0 +1,23 @@
+from utils import crud, payloads
+
+
+def test_login_without_profile_changes_keeps_order_payloads(db):
+    crud.upsert_user(db, "returning", "Returning", "returning", "13800000000")
+    version = payloads.get_orders_version()
+    crud.upsert_user(db, "returning", "Returning", "returning", "13800000000")
+    crud.upsert_user(db, "returning", "Returning")
+    assert payloads.get_orders_version() == version
+
+
+def test_login_with_new_name_invalidates_order_payloads(db):
+    crud.upsert_user(db, "renamed", "Old Name", "old")
+    version = payloads.get_orders_version()
+    user = crud.upsert_user(db, "renamed", "New Name")
+    assert user.name == "New Name" and user.pinyin == "old"
+    assert payloads.get_orders_version() > version
+
+
+def test_login_with_new_phone_is_stored(db):
+    crud.upsert_user(db, "moved", "Moved", "moved", "13800000000")
+    user = crud.upsert_user(db, "moved", "Moved", None, "13900000000")
+    assert (user.pinyin, user.phone) == ("moved", "13900000000")
@@ -0,0 +1,129 @@
+import json
+import time
+
+
+class RouteClass:
+    # Adaptive concurrency limit (AIMD) for one kind of request. Completions within the latency target grow the
+    # limit by about one per window of requests; a slow or failed completion shrinks it by a fifth, at most once per
+    # target interval so a single burst of slow responses doesn't collapse it to the minimum.
+    def __init__(self, name: str, priority: int, target: float, initial: int, minimum: int, maximum: int):
+        self.name = name
+        self.priority = priority  # 0 is the most important
+        self.target = target  # Seconds
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.latency = 0.0
+        self.rejected = 0
+        self.decreased_at = 0.0
+
+    def completed(self, latency: float, failed: bool):
+        self.latency = latency if self.latency == 0 else self.latency * 0.8 + latency * 0.2
+        now = time.monotonic()
+        if failed or latency > self.target:
+            if now - self.decreased_at >= self.target:
+                self.limit = max(self.minimum, self.limit * 0.8)
+                self.decreased_at = now
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow while the limit is actually being used, otherwise it drifts up during quiet hours
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "inFlight": self.in_flight,
+            "latencyMs": round(self.latency * 1000, 1),
+            "rejected": self.rejected
+        }
+
+
+class AdmissionLimiter:
+    # All classes also share max_in_flight, roughly the threadpool size. Lower priorities may only use part of it,
+    # so when everything is busy analytics and exports are turned away first and orders keep their headroom.
+    def __init__(self, classes: list[RouteClass], max_in_flight: int = 40, shares: tuple[float, ...] = (1.0, 0.6, 0.3)):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.max_in_flight = max_in_flight
+        self.shares = shares
+        self.in_flight = 0
+
+    def classify(self, method: str, path: str) -> RouteClass | None:
+        # None means not limited: long-lived streams and the metrics needed to watch an overload
+        if path == "/order/events" or path == "/metrics" or path.startswith("/uploads/"):
+            return None
+        if path.startswith("/statistics") or path.startswith("/orders/all") or path.startswith("/admin"):
+            return self.classes["admin"]
+        if path == "/order" and method in ("POST", "PATCH", "DELETE"):
+            return self.classes["orders"]
+        return self.classes["reads"]
+
+    def acquire(self, route_class: RouteClass) -> bool:
+        share = self.shares[min(route_class.priority, len(self.shares) - 1)]
+        if route_class.in_flight + 1 > route_class.limit or self.in_flight + 1 > self.max_in_flight * share:
+            route_class.rejected += 1
+            return False
+        route_class.in_flight += 1
+        self.in_flight += 1
+        return True
+
+    def release(self, route_class: RouteClass, latency: float, failed: bool):
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        route_class.completed(latency, failed)
+
+    def stats(self):
+        return {
+            "maxInFlight": self.max_in_flight,
+            "inFlight": self.in_flight,
+            "classes": {name: route_class.stats() for name, route_class in self.classes.items()}
+        }
+
+
+limiter = AdmissionLimiter([
+    RouteClass("orders", priority=0, target=1.0, initial=16, minimum=4, maximum=40),
+    RouteClass("reads", priority=1, target=0.25, initial=24, minimum=4, maximum=64),
+    RouteClass("admin", priority=2, target=5.0, initial=4, minimum=1, maximum=8)
+])
+
+BUSY_BODY = json.dumps({"detail": "Server busy"}).encode()
+
+
+class AdmissionMiddleware:
+    # Rejects requests over their class limit with an immediate 503 instead of letting them queue for the threadpool.
+    # Everything runs on the event loop, so the counters need no locking.
+    def __init__(self, app, limiter: AdmissionLimiter = limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        route_class = self.limiter.classify(scope["method"], path)
+        if route_class is None:
+            return await self.app(scope, receive, send)
+        if not self.limiter.acquire(route_class):
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(BUSY_BODY)).encode()),
+                (b"retry-after", b"1")
+            ]})
+            await send({"type": "http.response.body", "body": BUSY_BODY})
+            return
+
+        status = 500
+        started = time.monotonic()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.limiter.release(route_class, time.monotonic() - started, status >= 500)
@@ -0,0 +1,56 @@
+import time
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+
+from utils import catalog
+from utils.dependencies import get_db
+from utils.settings import settings_store
+
+# The catalog version is an in-process counter that restarts at 1, so tags also carry the process start.
+# It only moves on writes made by this process, which is why main.py refuses to run more than one worker
+EPOCH = format(int(time.time() * 1000), "x")
+
+
+def catalog_version(session: Session) -> str:
+    return f"{EPOCH}.{catalog.get_version()}"
+
+
+def settings_version(session: Session) -> str:
+    # Settings versions live in the database and survive restarts; refresh() reads them at most once a second
+    settings_store.refresh(session)
+    return str(settings_store.version)
+
+
+class ConditionalGet:
+    # Dependency giving a route a strong ETag derived from a data version, answering If-None-Match with a 304
+    # before the route body runs, so an unchanged resource costs neither a query nor serialization.
+    # Usage: @router.get(..., dependencies=[Depends(ConditionalGet("catalog", catalog_version, "public, max-age=60"))])
+    def __init__(self, scope: str, version: Callable[[Session], str], cache_control: str):
+        self.scope = scope
+        self.version = version
+        self.cache_control = cache_control
+
+    def __call__(self, request: Request, response: Response, db: Session = Depends(get_db)):
+        etag = f'"{self.scope}-{self.version(db)}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes added by proxies still match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+ITEMS_CACHE = ConditionalGet("catalog", catalog_version, "public, max-age=30")
+CATEGORIES_CACHE = ConditionalGet("catalog", catalog_version, "public, max-age=300")
+ADS_CACHE = ConditionalGet("catalog", catalog_version, "public, max-age=600")
+# Shop opening hours flip through settings, so clients always revalidate (a cheap 304 while nothing changed)
+SETTINGS_CACHE = ConditionalGet("settings", settings_version, "no-cache")
@@ -0,0 +1,92 @@
+import threading
+
+from sqlalchemy.orm import Session, selectinload
+
+from data.models import Ad, Category, ItemType, OptionType
+from data.schemas import AdSchema, CategorySchema, ItemTypeSchema
+
+
+class CatalogSnapshot:
+    # Immutable view of the whole menu, built in one pass and shared by every request until the catalog changes
+    def __init__(self, version: int, items: list[ItemTypeSchema], categories: list[CategorySchema], ads: list[AdSchema]):
+        self.version = version
+        self.items = tuple(items)
+        self.categories = tuple(categories)
+        self.ads = tuple(ads)
+        self.items_by_id = {item.id: item for item in self.items}
+        self.categories_by_id = {category.id: category for category in self.categories}
+        items_by_category = {}
+        for item in self.items:
+            items_by_category.setdefault(item.category.id, []).append(item)
+        self.items_by_category = {key: tuple(value) for key, value in items_by_category.items()}
+
+    def get_item_types(self):
+        return list(self.items)
+
+    def get_item_type(self, itemtype_id: int):
+        return self.items_by_id.get(itemtype_id)
+
+    def get_item_types_by_category(self, category_id: int):
+        return list(self.items_by_category.get(category_id, ()))
+
+    def get_categories(self):
+        return list(self.categories)
+
+    def get_category(self, category_id: int):
+        return self.categories_by_id.get(category_id)
+
+    def get_ads(self):
+        return list(self.ads)
+
+
+# Per process, bumped by the admin views on every catalog write. Correct as long as there is a single worker
+_version = 1
+_snapshot: CatalogSnapshot | None = None
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def build_snapshot(session: Session, version: int) -> CatalogSnapshot:
+    item_types = (session.query(ItemType)
+                  .options(selectinload(ItemType.category),
+                           selectinload(ItemType.tags),
+                           selectinload(ItemType.options).selectinload(OptionType.items))
+                  .order_by(ItemType.id)
+                  .all())
+    categories = session.query(Category).order_by(Category.id).all()
+    ads = session.query(Ad).order_by(Ad.id).all()
+    return CatalogSnapshot(
+        version,
+        [ItemTypeSchema.model_validate(item_type) for item_type in item_types],
+        [CategorySchema.model_validate(category) for category in categories],
+        [AdSchema.model_validate(ad) for ad in ads]
+    )
+
+
+def get_catalog(session: Session) -> CatalogSnapshot:
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None:
+        return snapshot
+    with _build_lock:
+        snapshot = _snapshot
+        if snapshot is not None:
+            return snapshot
+        version = _version
+        snapshot = build_snapshot(session, version)
+        with _lock:
+            # Only publish if nothing changed while we were reading, otherwise the next request rebuilds
+            if _version == version:
+                _snapshot = snapshot
+        return snapshot
+
+
+def get_version() -> int:
+    return _version
+
+
+def invalidate():
+    global _snapshot, _version
+    with _lock:
+        _version += 1
+        _snapshot = None
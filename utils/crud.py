@@ -1,15 +1,41 @@
+import base64
 import datetime
+import json
 from decimal import Decimal, getcontext
 
 from fastapi import HTTPException
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete, and_, or_, func, case, cast, literal, inspect, Integer, String
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session, aliased, selectinload
 from data.models import *
-from data.schemas import OrderedItemCreateSchema, OrderCreateSchema
+from data.schemas import OrderedItemCreateSchema, OrderCreateSchema, OrderSummarySchema
 from utils.dependencies import TIME_ZONE
+from utils import events, payloads
+from utils.order_queue import queue
+from utils.settings import settings_store, VERSION_KEY
+from utils.user_cache import user_cache
 
 getcontext().prec = 5
 
+# Loader options matching the shape of ItemTypeSchema and OrderSchema, so serializing a response
+# costs a fixed number of queries instead of one per relationship per row
+ITEM_TYPE_LOADER = (
+    selectinload(ItemType.category),
+    selectinload(ItemType.tags),
+    selectinload(ItemType.options).selectinload(OptionType.items)
+)
+ORDER_LOADER = (
+    selectinload(Order.user),
+    selectinload(Order.items).selectinload(OrderedItem.itemType).options(*ITEM_TYPE_LOADER),
+    selectinload(Order.items).selectinload(OrderedItem.appliedOptions)
+)
+# Only what the order exports print, so each batch of a streamed export is a handful of queries
+EXPORT_ORDER_LOADER = (
+    selectinload(Order.user),
+    selectinload(Order.items).selectinload(OrderedItem.itemType),
+    selectinload(Order.items).selectinload(OrderedItem.appliedOptions).selectinload(OptionItem.type)
+)
+
 
 def ensure_not_none(value):
     if value is None:
@@ -42,12 +68,49 @@ def update_user(session: Session, user: User, user_name: str | None = None, piny
     if phone is not None:
         user.phone = phone
     session.commit()
+    user_cache.invalidate(user.id)
+    payloads.orders_changed()
     return user
 
 
+def upsert_user(session: Session, user_id: str, user_name: str, pinyin: str | None = None, phone: str | None = None):
+    # Creates the user or refreshes their profile in one statement, keeping stored values for missing fields
+    values = dict(id=user_id, name=user_name, pinyin=pinyin, phone=phone, points=0)
+
+    def profile(new):
+        return {
+            "name": new.name,
+            "pinyin": func.coalesce(new.pinyin, User.pinyin),
+            "phone": func.coalesce(new.phone, User.phone)
+        }
+
+    if session.get_bind().dialect.name == "mysql":
+        statement = mysql.insert(User).values(**values)
+        statement = statement.on_duplicate_key_update(profile(statement.inserted))
+        # With CLIENT_FOUND_ROWS an insert or an unchanged row counts 1, a changed row 2
+        changed = session.execute(statement).rowcount == 2
+    else:
+        statement = sqlite.insert(User).values(**values)
+        update = profile(statement.excluded)
+        # Skips the update when nothing differs, so only an insert or a changed profile counts a row
+        statement = statement.on_conflict_do_update(index_elements=[User.id], set_=update,
+                                                    where=or_(*(getattr(User, key).is_distinct_from(value)
+                                                                for key, value in update.items())))
+        changed = session.execute(statement).rowcount == 1
+    session.commit()
+    user_cache.invalidate(user_id)
+    # Orders show the name and pinyin, most logins change nothing and must not invalidate the order payloads
+    if changed:
+        payloads.orders_changed()
+    return get_user(session, user_id)
+
+
 def delete_user(session: Session, user: User):
+    user_id = user.id
     session.delete(user)
     session.commit()
+    user_cache.invalidate(user_id)
+    payloads.orders_changed()
 
 
 def get_categories(session: Session):
@@ -102,51 +165,281 @@ def get_ordered_item(session: Session, ordereditem_id: int):
     return session.query(OrderedItem).filter(OrderedItem.id == ordereditem_id).one_or_none()
 
 
-def create_ordered_item(session: Session, order: int, schema: OrderedItemCreateSchema):
+def create_ordered_item(session: Session, order: int, schema: OrderedItemCreateSchema, option_items: dict[int, OptionItem]):
     ordered_item = OrderedItem(
         orderId=order,
         itemTypeId=schema.itemType,
         amount=schema.amount
     )
     for id in schema.appliedOptions:
-        ordered_item.appliedOptions.append(get_option_item(session, id))
+        ordered_item.appliedOptions.append(option_items[id])
     session.add(ordered_item)
     return ordered_item
 
 
+def resolve_cart(session: Session, items: list[OrderedItemCreateSchema]):
+    # Loads everything a cart references with one IN query per table and validates it,
+    # so placing an order costs the same number of queries regardless of cart size
+    item_type_ids = {item.itemType for item in items}
+    option_ids = {option for item in items for option in item.appliedOptions}
+    item_types = {item_type.id: item_type for item_type in
+                  session.query(ItemType).filter(ItemType.id.in_(item_type_ids)).all()}
+    option_items = {}
+    if option_ids:
+        option_items = {option.id: option for option in
+                        session.query(OptionItem).filter(OptionItem.id.in_(option_ids)).all()}
+    applicable = set(session.execute(select(itemOptionAssociation.c.item_type_id, itemOptionAssociation.c.option_type_id)
+                                     .where(itemOptionAssociation.c.item_type_id.in_(item_type_ids))).all())
+
+    for item in items:
+        item_type = ensure_not_none(item_types.get(item.itemType))
+        if item_type.soldOut:
+            raise HTTPException(status_code=403, detail="Item sold out")
+        for option in item.appliedOptions:
+            option_item = ensure_not_none(option_items.get(option))
+            if option_item.soldOut:
+                raise HTTPException(status_code=403, detail="Option sold out")
+            if (item_type.id, option_item.typeId) not in applicable:
+                raise HTTPException(status_code=400, detail="Option not applicable")
+    return item_types, option_items
+
+
 def get_order(session: Session, order_id: int):
-    return session.query(Order).filter(Order.id == order_id).one_or_none()
+    return session.query(Order).options(*ORDER_LOADER).filter(Order.id == order_id).one_or_none()
 
 
 def get_order_by_number(session: Session, number: str):
-    return session.query(Order).filter(Order.number == number).order_by(Order.createdTime.desc()).first()
+    order = (session.query(Order)
+             .options(*ORDER_LOADER)
+             .filter(Order.businessDate == get_business_date(), Order.number == number)
+             .one_or_none())
+    if order is None:
+        # Numbers restart every day, fall back to the most recent day that used this one
+        order = session.query(Order).options(*ORDER_LOADER).filter(Order.number == number).order_by(Order.createdTime.desc()).first()
+    return order
 
 
 def get_orders_query_by_user(user_id: str):
     # Note that this does not return everything queried - this is an uncompleted query to be paginated
-    return select(Order).filter(Order.userId == user_id).order_by(Order.createdTime.desc())
-
+    return select(Order).options(*ORDER_LOADER).filter(Order.userId == user_id).order_by(Order.createdTime.desc())
 
-def get_orders_by_date(session: Session, date: datetime.datetime):
-    return session.query(Order).filter(Order.createdTime >= date).filter(Order.createdTime < date + datetime.timedelta(days=1)).order_by(Order.createdTime.desc()).all()
 
-
-def get_orders_by_user(session: Session, user_id: str):
-    return session.query(Order).filter(Order.userId == user_id).order_by(Order.createdTime.desc()).all()
-
-
-def get_orders_by_on_site_name(session: Session, on_site_name: str):
-    return session.query(Order).filter(Order.onSiteName == on_site_name).order_by(Order.createdTime.desc()).all()
+def has_unpaid_order(session: Session, user_id: str | None = None, on_site_name: str | None = None) -> bool:
+    query = select(Order.id).where(Order.paid == False)
+    if user_id is not None:
+        query = query.where(Order.userId == user_id)
+    else:
+        query = query.where(Order.onSiteName == on_site_name)
+    return session.execute(select(query.exists())).scalar()
+
+
+def active_order_query(user_id):
+    # Id of the latest order that is still unpaid or waiting. Each half is a single seek on its own index, where one
+    # OR condition would walk the user's whole history on loyal customers
+    unpaid_order = aliased(Order)
+    waiting_order = aliased(Order)
+    unpaid = (select(unpaid_order.id)
+              .where(unpaid_order.userId == user_id, unpaid_order.paid == False)
+              .order_by(unpaid_order.createdTime.desc())
+              .limit(1)
+              .correlate_except(unpaid_order)
+              .scalar_subquery())
+    waiting = (select(waiting_order.id)
+               .where(waiting_order.userId == user_id, waiting_order.status == OrderStatus.waiting)
+               .order_by(waiting_order.createdTime.desc())
+               .limit(1)
+               .correlate_except(waiting_order)
+               .scalar_subquery())
+    return (select(Order.id)
+            .where(Order.id.in_([unpaid, waiting]))
+            .order_by(Order.createdTime.desc())
+            .limit(1)
+            .scalar_subquery())
+
+
+def get_active_order(session: Session, user_id: str):
+    # Served from the maintained User.activeOrderId, a primary key read
+    active_order_id = session.execute(select(User.activeOrderId).where(User.id == user_id)).scalar()
+    return session.get(Order, active_order_id) if active_order_id is not None else None
+
+
+def change_user_totals(session: Session, user_id: str, orders: int = 0, cups: int = 0, spent: Decimal = 0):
+    session.execute(update(User)
+                    .where(User.id == user_id)
+                    .values(totalOrders=User.totalOrders + orders, totalCups=User.totalCups + cups,
+                            totalSpent=User.totalSpent + spent)
+                    .execution_options(synchronize_session=False))
+
+
+def refresh_active_order(session: Session, user_id: str):
+    session.flush()
+    session.execute(update(User)
+                    .where(User.id == user_id)
+                    .values(activeOrderId=active_order_query(user_id))
+                    .execution_options(synchronize_session=False))
+
+
+def reconcile_user_totals(session: Session):
+    # Recomputes every user's totals from the orders and repairs the ones that drifted, returns how many were fixed
+    orders = select(func.count(Order.id)).where(Order.userId == User.id).scalar_subquery()
+    cups = (select(func.coalesce(func.sum(OrderedItem.amount), 0))
+            .join(Order, Order.id == OrderedItem.orderId)
+            .where(Order.userId == User.id)
+            .scalar_subquery())
+    spent = select(func.coalesce(func.sum(Order.totalPrice), 0)).where(Order.userId == User.id).scalar_subquery()
+    rows = session.execute(select(User.id, User.totalOrders, User.totalCups, User.totalSpent, User.activeOrderId,
+                                  orders, cups, spent, active_order_query(User.id))).all()
+    repaired = 0
+    for user_id, *stored, total_orders, total_cups, total_spent, active_order_id in rows:
+        expected = [total_orders, int(total_cups), Decimal(total_spent), active_order_id]
+        if stored != expected:
+            session.execute(update(User)
+                            .where(User.id == user_id)
+                            .values(totalOrders=total_orders, totalCups=int(total_cups), totalSpent=total_spent,
+                                    activeOrderId=active_order_id)
+                            .execution_options(synchronize_session=False))
+            repaired += 1
+    session.commit()
+    return repaired
 
 
 def get_orders_today(session: Session):
-    now = datetime.datetime.now(tz=TIME_ZONE)
-    return get_orders_by_date(session, datetime.datetime(now.year, now.month, now.day, 0, 0, 0, tzinfo=TIME_ZONE))
+    start, end = get_business_day_window()
+    return (session.query(Order)
+            .options(*ORDER_LOADER)
+            .filter(Order.createdTime >= start)
+            .filter(Order.createdTime < end)
+            .order_by(Order.createdTime.desc())
+            .all())
 
 
 def get_orders():
     # Note that this does not return everything queried - this is an uncompleted query to be paginated
-    return select(Order).order_by(Order.createdTime.desc())
+    return select(Order).options(*ORDER_LOADER).order_by(Order.createdTime.desc())
+
+
+def parse_summary_fields(fields: str | None) -> tuple[str, ...]:
+    if fields is None:
+        return tuple(OrderSummarySchema.model_fields)
+    selected = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in OrderSummarySchema.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail="Unknown fields: " + ", ".join(unknown))
+    return selected
+
+
+def summarize_orders(session: Session, orders: list[Order], fields: tuple[str, ...]):
+    # Plain dicts shaped like OrderSummarySchema. Items, options and user names are fetched as bare columns,
+    # one query each and only when asked for, instead of loading whole ItemTypes, OptionTypes and Users
+    order_ids = [order.id for order in orders]
+    user_names = {}
+    if "userName" in fields:
+        user_ids = {order.userId for order in orders if order.userId is not None}
+        if user_ids:
+            user_names = dict(session.execute(select(User.id, User.name).where(User.id.in_(user_ids))).all())
+    items = {}
+    if "items" in fields and order_ids:
+        rows = session.execute(select(OrderedItem.id, OrderedItem.orderId, OrderedItem.itemTypeId, OrderedItem.amount)
+                               .where(OrderedItem.orderId.in_(order_ids))
+                               .order_by(OrderedItem.id)).all()
+        options = {}
+        if rows:
+            for item_id, option_id in session.execute(
+                    select(orderedItemOptionAssoc.c.ordered_item_id, orderedItemOptionAssoc.c.option_item_id)
+                    .where(orderedItemOptionAssoc.c.ordered_item_id.in_([row[0] for row in rows]))):
+                options.setdefault(item_id, []).append(option_id)
+        for item_id, order_id, item_type_id, amount in rows:
+            items.setdefault(order_id, []).append({
+                "id": item_id,
+                "itemTypeId": item_type_id,
+                "appliedOptionIds": sorted(options.get(item_id, [])),
+                "amount": amount
+            })
+    result = []
+    for order in orders:
+        values = {
+            "id": order.id,
+            "totalPrice": order.totalPrice,
+            "number": order.number,
+            "status": order.status.value,
+            "createdTime": order.createdTime,
+            "type": order.type.value,
+            "deliveryRoom": order.deliveryRoom,
+            "userId": order.userId,
+            "userName": user_names.get(order.userId),
+            "items": items.get(order.id, []),
+            "onSiteName": order.onSiteName,
+            "paid": order.paid
+        }
+        result.append({field: values[field] for field in fields})
+    return result
+
+
+def get_order_summaries_today(session: Session, fields: tuple[str, ...]):
+    start, end = get_business_day_window()
+    orders = (session.query(Order)
+              .filter(Order.createdTime >= start)
+              .filter(Order.createdTime < end)
+              .order_by(Order.createdTime.desc())
+              .all())
+    return summarize_orders(session, orders, fields)
+
+
+def encode_order_cursor(order: Order) -> str:
+    # Opaque to clients, it is just the (createdTime, id) of the last order on the page
+    payload = json.dumps([order.createdTime.isoformat(), order.id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_order_cursor(cursor: str):
+    try:
+        created_time, order_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(created_time), int(order_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate_orders_by_cursor(session: Session, query, cursor: str | None, size: int):
+    # Keyset pagination on (createdTime, id): each page is an index range scan starting right after the previous one,
+    # so it costs the same at any depth, needs no COUNT(*) and never skips or repeats rows when new orders come in
+    query = query.order_by(None).order_by(Order.createdTime.desc(), Order.id.desc())
+    if cursor is not None:
+        created_time, order_id = decode_order_cursor(cursor)
+        query = query.where(or_(Order.createdTime < created_time,
+                                and_(Order.createdTime == created_time, Order.id < order_id)))
+    orders = session.scalars(query.limit(size + 1)).all()
+    return {
+        "items": orders[:size],
+        "size": size,
+        "nextCursor": encode_order_cursor(orders[size - 1]) if len(orders) > size else None
+    }
+
+
+def get_order_summaries_page(session: Session, cursor: str | None, size: int, fields: tuple[str, ...]):
+    page = paginate_orders_by_cursor(session, select(Order), cursor, size)
+    page["items"] = summarize_orders(session, page["items"], fields)
+    return page
+
+
+def iter_orders_since(session: Session, since: datetime.datetime, batch_size: int = 500):
+    # Streams orders newest first, one keyset page on (createdTime, id) at a time. Each page is a plain buffered query
+    # with its own selectin loads: yield_per would hold a server-side cursor open across them, which pymysql can't do
+    query = (select(Order)
+             .options(*EXPORT_ORDER_LOADER)
+             .where(Order.createdTime >= since)
+             .order_by(Order.createdTime.desc(), Order.id.desc())
+             .limit(batch_size))
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.where(or_(Order.createdTime < last.createdTime,
+                                  and_(Order.createdTime == last.createdTime, Order.id < last.id)))
+        orders = session.scalars(page).all()
+        yield from orders
+        if len(orders) < batch_size:
+            return
+        last = orders[-1]
 
 
 def try_match_user(session: Session, name: str):
@@ -156,7 +449,146 @@ def try_match_user(session: Session, name: str):
     return None
 
 
-def create_order(session: Session, schema: OrderCreateSchema, user: User):
+def get_business_date(time: datetime.datetime | None = None) -> datetime.date:
+    if time is None:
+        time = datetime.datetime.now(tz=TIME_ZONE)
+    elif time.tzinfo is not None:
+        time = time.astimezone(TIME_ZONE)
+    return time.date()
+
+
+def get_business_day_window(day: datetime.date | None = None):
+    # createdTime bounds of a business day (today by default), stored times are local to TIME_ZONE
+    start = datetime.datetime.combine(day or get_business_date(), datetime.time())
+    return start, start + datetime.timedelta(days=1)
+
+
+def insert_ignore(session: Session, model, **values):
+    # Inserts a row unless its primary key already exists, without failing the surrounding transaction
+    if session.get_bind().dialect.name == "mysql":
+        statement = mysql.insert(model).values(**values)
+        # Assigning the key to itself is a no-op, so a row another transaction already updated is left alone
+        key = inspect(model).primary_key[0]
+        statement = statement.on_duplicate_key_update({key.name: key})
+    else:
+        statement = sqlite.insert(model).values(**values).on_conflict_do_nothing()
+    session.execute(statement)
+
+
+def count_daily_cups(session: Session, day: datetime.date):
+    start, end = get_business_day_window(day)
+    online, on_site = (session.query(func.sum(case((Order.onSiteName.is_(None), OrderedItem.amount), else_=0)),
+                                     func.sum(case((Order.onSiteName.is_not(None), OrderedItem.amount), else_=0)))
+                       .select_from(Order)
+                       .join(OrderedItem, OrderedItem.orderId == Order.id)
+                       .filter(Order.createdTime >= start)
+                       .filter(Order.createdTime < end)
+                       .one())
+    return int(online or 0), int(on_site or 0)
+
+
+def get_daily_cups(session: Session, day: datetime.date):
+    row = session.execute(select(DailyCounter.onlineCups, DailyCounter.onSiteCups)
+                          .where(DailyCounter.businessDate == day)).first()
+    if row is None:
+        # Days from before the counters existed, or nobody ordered yet
+        return count_daily_cups(session, day)
+    return row[0], row[1]
+
+
+def ensure_daily_counter(session: Session, day: datetime.date):
+    if session.execute(select(DailyCounter.businessDate).where(DailyCounter.businessDate == day)).first() is None:
+        online, on_site = count_daily_cups(session, day)
+        last_number = session.execute(select(func.max(cast(Order.number, Integer)))
+                                      .where(Order.businessDate == day)).scalar()
+        insert_ignore(session, DailyCounter, businessDate=day, onlineCups=online, onSiteCups=on_site,
+                      lastNumber=last_number or 0)
+
+
+def reserve_daily_cups(session: Session, day: datetime.date, cups: int, on_site: bool, quota: int) -> bool:
+    # Atomically adds the cups to the day unless the quota was already reached before this order
+    ensure_daily_counter(session, day)
+    column = DailyCounter.onSiteCups if on_site else DailyCounter.onlineCups
+    result = session.execute(update(DailyCounter)
+                             .where(DailyCounter.businessDate == day)
+                             .where(DailyCounter.onlineCups + DailyCounter.onSiteCups < quota)
+                             .values({column: column + cups})
+                             .execution_options(synchronize_session=False))
+    return result.rowcount == 1
+
+
+def release_daily_cups(session: Session, day: datetime.date, cups: int, on_site: bool):
+    column = DailyCounter.onSiteCups if on_site else DailyCounter.onlineCups
+    session.execute(update(DailyCounter)
+                    .where(DailyCounter.businessDate == day)
+                    .values({column: column - cups})
+                    .execution_options(synchronize_session=False))
+
+
+def next_order_number(session: Session, day: datetime.date) -> str:
+    # The UPDATE locks the day's row until commit, so no two orders can read the same number
+    ensure_daily_counter(session, day)
+    session.execute(update(DailyCounter)
+                    .where(DailyCounter.businessDate == day)
+                    .values(lastNumber=DailyCounter.lastNumber + 1)
+                    .execution_options(synchronize_session=False))
+    number = session.execute(select(DailyCounter.lastNumber).where(DailyCounter.businessDate == day)).scalar_one()
+    return str(number).zfill(3)
+
+
+def record_order_change(session: Session, order_id: int, day: datetime.date | None, deleted: bool = False):
+    # Like order numbers, the sequence comes from the day's counter row, which stays locked until commit,
+    # so changes become visible in sequence order and a reader never skips one that commits late
+    if day is None:
+        return
+    ensure_daily_counter(session, day)
+    session.execute(update(DailyCounter)
+                    .where(DailyCounter.businessDate == day)
+                    .values(lastChange=DailyCounter.lastChange + 1)
+                    .execution_options(synchronize_session=False))
+    seq = session.execute(select(DailyCounter.lastChange).where(DailyCounter.businessDate == day)).scalar_one()
+    session.add(OrderChange(businessDate=day, seq=seq, orderId=order_id, deleted=deleted))
+
+
+def get_last_order_change(session: Session, day: datetime.date) -> int:
+    return session.execute(select(DailyCounter.lastChange).where(DailyCounter.businessDate == day)).scalar() or 0
+
+
+def get_order_changes(session: Session, day: datetime.date, since: int):
+    # (orders changed after since and still there, ids deleted after since, latest seq)
+    rows = session.execute(select(OrderChange.seq, OrderChange.orderId, OrderChange.deleted)
+                           .where(OrderChange.businessDate == day, OrderChange.seq > since)
+                           .order_by(OrderChange.seq)).all()
+    latest = {}
+    for seq, order_id, deleted in rows:
+        latest[order_id] = deleted
+    changed = [order_id for order_id, deleted in latest.items() if not deleted]
+    orders = []
+    if changed:
+        orders = (session.query(Order)
+                  .options(*ORDER_LOADER)
+                  .filter(Order.id.in_(changed))
+                  .order_by(Order.createdTime.desc())
+                  .all())
+    deleted = [order_id for order_id, deleted in latest.items() if deleted]
+    return orders, deleted, rows[-1][0] if rows else since
+
+
+def prune_order_changes(session: Session, before: datetime.date):
+    session.execute(delete(OrderChange)
+                    .where(OrderChange.businessDate < before)
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+
+def create_order(session: Session, schema: OrderCreateSchema, user: User, quota: int = 999, cart=None):
+    item_types, option_items = cart if cart is not None else resolve_cart(session, schema.items)
+    day = get_business_date()
+    # CAVEAT: We allow for a single order to exceed the quota
+    if not reserve_daily_cups(session, day, sum(item.amount for item in schema.items),
+                              schema.onSiteOrder and schema.onSiteName is not None, quota):
+        raise HTTPException(status_code=403, detail="Order exceeds quota")
+
     # Try to match a user for on-site orders
     if schema.onSiteOrder:
         user = try_match_user(session, schema.onSiteName)
@@ -164,16 +596,17 @@ def create_order(session: Session, schema: OrderCreateSchema, user: User):
     order = Order(
         status=OrderStatus.waiting,
         createdTime=datetime.datetime.now(tz=TIME_ZONE),
+        businessDate=day,
         type=schema.type,
         deliveryRoom=schema.deliveryRoom,
         userId=user.id if user is not None else None,
         onSiteName=schema.onSiteName if schema.onSiteOrder else None
     )
     for item in schema.items:
-        order.items.append(create_ordered_item(session, order.id, item))
+        order.items.append(create_ordered_item(session, order.id, item, option_items))
     total_price = Decimal("0")
     for item in order.items:
-        item_type = get_item_type(session, item.itemTypeId)
+        item_type = item_types[item.itemTypeId]
         item_price = item_type.basePrice * item_type.salePercent
         for option in item.appliedOptions:
             item_price += option.priceChange
@@ -181,40 +614,251 @@ def create_order(session: Session, schema: OrderCreateSchema, user: User):
         total_price += item_price
     order.totalPrice = total_price
 
-    latest = session.query(Order).order_by(Order.createdTime.desc()).first()
-    if latest is None or datetime.datetime.now(tz=TIME_ZONE).day != latest.createdTime.day:
-        order.number = "001"
-    else:
-        order.number = str(int(latest.number) + 1).zfill(3)
+    order.number = next_order_number(session, day)
+    cups = sum(item.amount for item in schema.items)
+    on_site = order.onSiteName is not None
+    new_user = not session.query(session.query(Order.id)
+                                 .filter(Order.businessDate == day)
+                                 .filter(Order.userId == order.userId if order.userId is not None
+                                         else Order.userId.is_(None))
+                                 .exists()).scalar()
+    change_daily_stats(session, day, orderValue=total_price, orders=1, cups=cups, uniqueUsers=int(new_user),
+                       pickUpOrders=int(schema.type == OrderType.pickUp.value),
+                       deliveryOrders=int(schema.type == OrderType.delivery.value),
+                       onSiteOrders=int(on_site), onlineOrders=int(not on_site),
+                       onSiteCups=cups if on_site else 0, onlineCups=0 if on_site else cups)
     session.add(order)
+    session.flush()
+    order_id = order.id
+    record_order_change(session, order_id, day)
+    if order.userId is not None:
+        # The new order is the user's latest and is neither done nor paid
+        change_user_totals(session, order.userId, orders=1, cups=cups, spent=total_price)
+        session.execute(update(User)
+                        .where(User.id == order.userId)
+                        .values(activeOrderId=order_id)
+                        .execution_options(synchronize_session=False))
     session.commit()
+    payloads.orders_changed()
+    order = get_order(session, order_id)
+    queue.add(order, sum(item.amount for item in order.items))
+    events.orders_changed()
     return order
 
 
 def update_order_status(session: Session, order: Order, new_status: str | None, new_paid: bool | None):
+    # Every order write locks the day's counter, then its dailystats row, then users, so writers can't deadlock
+    record_order_change(session, order.id, order.businessDate)
     if new_status is not None:
         order.status = new_status
-    if new_paid is not None:
-        if order.user is not None:
-            if new_paid and not order.paid:
-                order.user.points += order.totalPrice
-            if not new_paid and order.paid:
-                order.user.points -= order.totalPrice
+    if new_paid is not None and new_paid != order.paid:
+        sign = 1 if new_paid else -1
+        if order.businessDate is not None:
+            change_daily_stats(session, order.businessDate, revenue=sign * order.totalPrice, paidOrders=sign)
+        if order.userId is not None:
+            # Applied in SQL so two staff members settling orders of the same user can't overwrite each other
+            session.execute(update(User)
+                            .where(User.id == order.userId)
+                            .values(points=User.points + sign * order.totalPrice)
+                            .execution_options(synchronize_session=False))
         order.paid = new_paid
+    if order.userId is not None:
+        refresh_active_order(session, order.userId)
     session.commit()
+    payloads.orders_changed()
+    if new_status is not None:
+        if order.status == OrderStatus.waiting:
+            queue.add(order, sum(item.amount for item in order.items))
+        else:
+            queue.remove(order.id)
+        events.orders_changed()
 
 
 def delete_order(session: Session, order: Order):
+    order_id = order.id
+    cups = sum(item.amount for item in order.items)
+    on_site = order.onSiteName is not None
+    release_daily_cups(session, get_business_date(order.createdTime), cups, on_site)
+    if order.businessDate is not None:
+        last_of_user = not session.query(session.query(Order.id)
+                                         .filter(Order.businessDate == order.businessDate)
+                                         .filter(Order.id != order.id)
+                                         .filter(Order.userId == order.userId if order.userId is not None
+                                                 else Order.userId.is_(None))
+                                         .exists()).scalar()
+        change_daily_stats(session, order.businessDate, orderValue=-order.totalPrice, orders=-1, cups=-cups,
+                           uniqueUsers=-int(last_of_user),
+                           revenue=-order.totalPrice if order.paid else 0, paidOrders=-int(order.paid),
+                           pickUpOrders=-int(order.type == OrderType.pickUp),
+                           deliveryOrders=-int(order.type == OrderType.delivery),
+                           onSiteOrders=-int(on_site), onlineOrders=-int(not on_site),
+                           onSiteCups=-cups if on_site else 0, onlineCups=0 if on_site else -cups)
+    user_id = order.userId
+    total_price = order.totalPrice
+    record_order_change(session, order_id, order.businessDate, deleted=True)
     session.delete(order)
+    if user_id is not None:
+        change_user_totals(session, user_id, orders=-1, cups=-cups, spent=-total_price)
+        refresh_active_order(session, user_id)
     session.commit()
+    payloads.orders_changed()
+    queue.remove(order_id)
+    events.orders_changed()
+
+
+def compute_daily_stats(session: Session, *criteria):
+    # One DailyStats row per business date, computed from the orders themselves
+    on_site = Order.onSiteName.is_not(None)
+    cups = (select(OrderedItem.orderId, func.sum(OrderedItem.amount).label("cups"))
+            .group_by(OrderedItem.orderId)
+            .subquery())
+    order_cups = func.coalesce(cups.c.cups, 0)
+    rows = (session.query(Order.businessDate,
+                          func.coalesce(func.sum(case((Order.paid, Order.totalPrice), else_=0)), 0),
+                          func.coalesce(func.sum(Order.totalPrice), 0),
+                          func.count(Order.id),
+                          func.sum(case((Order.paid, 1), else_=0)),
+                          func.sum(order_cups),
+                          func.count(Order.userId.distinct()) + func.max(case((Order.userId.is_(None), 1), else_=0)),
+                          func.sum(case((Order.type == OrderType.pickUp, 1), else_=0)),
+                          func.sum(case((Order.type == OrderType.delivery, 1), else_=0)),
+                          func.sum(case((on_site, 1), else_=0)),
+                          func.sum(case((on_site, 0), else_=1)),
+                          func.sum(case((on_site, order_cups), else_=0)),
+                          func.sum(case((on_site, 0), else_=order_cups)))
+            .outerjoin(cups, cups.c.orderId == Order.id)
+            .filter(Order.businessDate.is_not(None), *criteria)
+            .group_by(Order.businessDate)
+            .all())
+    return [DailyStats(businessDate=row[0], revenue=row[1], orderValue=row[2], orders=row[3], paidOrders=int(row[4]),
+                       cups=int(row[5]), uniqueUsers=int(row[6]), pickUpOrders=int(row[7]),
+                       deliveryOrders=int(row[8]), onSiteOrders=int(row[9]), onlineOrders=int(row[10]),
+                       onSiteCups=int(row[11]), onlineCups=int(row[12]))
+            for row in rows]
+
+
+def ensure_daily_stats(session: Session, day: datetime.date):
+    if session.execute(select(DailyStats.businessDate).where(DailyStats.businessDate == day)).first() is None:
+        insert_ignore(session, DailyStats, businessDate=day)
+
+
+def change_daily_stats(session: Session, day: datetime.date, **deltas):
+    # Applied as col = col + delta in the same transaction as the order change, so concurrent writers never lose updates
+    ensure_daily_stats(session, day)
+    values = {getattr(DailyStats, key): getattr(DailyStats, key) + value for key, value in deltas.items() if value}
+    if values:
+        session.execute(update(DailyStats)
+                        .where(DailyStats.businessDate == day)
+                        .values(values)
+                        .execution_options(synchronize_session=False))
+
+
+def rebuild_daily_stats(session: Session, since: datetime.date | None = None):
+    # Recomputes the rollup from scratch, for repairs and for days that were edited outside the API
+    criteria = [] if since is None else [Order.businessDate >= since]
+    statement = delete(DailyStats)
+    if since is not None:
+        statement = statement.where(DailyStats.businessDate >= since)
+    session.execute(statement.execution_options(synchronize_session=False))
+    rows = compute_daily_stats(session, *criteria)
+    session.add_all(rows)
+    session.commit()
+    return len(rows)
+
+
+def get_daily_stats(session: Session, since: datetime.date | None = None, until: datetime.date | None = None):
+    query = session.query(DailyStats)
+    if since is not None:
+        query = query.filter(DailyStats.businessDate >= since)
+    if until is not None:
+        query = query.filter(DailyStats.businessDate <= until)
+    return query.order_by(DailyStats.businessDate.desc()).all()
+
+
+def get_stats_bucket(session: Session, by: str, column=Order.createdTime):
+    # Start of the day / week / month (or the exact second) a time or date falls into, formatted like the statistics keys
+    if session.get_bind().dialect.name == "mysql":
+        if by == "individual":
+            return func.date_format(column, "%Y-%m-%d %H:%i:%s")
+        if by == "week":
+            return func.date_format(func.subdate(column, func.weekday(column)), "%Y-%m-%d")
+        if by == "month":
+            return func.date_format(column, "%Y-%m-01")
+        return func.date_format(column, "%Y-%m-%d")
+    if by == "individual":
+        return func.strftime("%Y-%m-%d %H:%M:%S", column)
+    if by == "week":
+        weekday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+        return func.date(column, literal("-") + cast(weekday, String) + literal(" days"))
+    if by == "month":
+        return func.strftime("%Y-%m-01", column)
+    return func.date(column)
+
+
+def aggregate_orders(session: Session, bucket, *criteria):
+    # {bucket: (orders, paid revenue or None, unique users, cups)}, newest bucket first.
+    # On-site orders without a matched user count as one more unique user, like a set containing None would.
+    rows = (session.query(bucket,
+                          func.count(Order.id),
+                          func.sum(case((Order.paid, Order.totalPrice))),
+                          func.count(Order.userId.distinct()) + func.max(case((Order.userId.is_(None), 1), else_=0)))
+            .filter(*criteria)
+            .group_by(bucket)
+            .order_by(bucket.desc())
+            .all())
+    cups = dict(session.query(bucket, func.sum(OrderedItem.amount))
+                .select_from(Order)
+                .join(OrderedItem, OrderedItem.orderId == Order.id)
+                .filter(*criteria)
+                .group_by(bucket)
+                .all())
+    return {row[0]: (row[1], row[2], int(row[3]), int(cups.get(row[0]) or 0)) for row in rows}
+
+
+def aggregate_daily_stats(session: Session, bucket, *criteria):
+    # Same shape as aggregate_orders, summed over the daily rollup. Sums stay in the database, where they are exact
+    rows = (session.query(bucket,
+                          func.sum(DailyStats.orders),
+                          case((func.sum(DailyStats.paidOrders) > 0, func.sum(DailyStats.revenue))),
+                          func.sum(DailyStats.uniqueUsers),
+                          func.sum(DailyStats.cups))
+            .filter(DailyStats.orders > 0, *criteria)
+            .group_by(bucket)
+            .order_by(bucket.desc())
+            .all())
+    return {row[0]: (int(row[1]), row[2], int(row[3]), int(row[4])) for row in rows}
+
+
+def get_order_value(session: Session, since: datetime.date, until: datetime.date):
+    # Total value of every order, paid or not, over a range of business dates
+    return session.execute(select(func.sum(DailyStats.orderValue))
+                           .where(DailyStats.businessDate >= since, DailyStats.businessDate <= until)).scalar() or 0
+
+
+def count_unique_users(session: Session, bucket, *criteria):
+    rows = (session.query(bucket,
+                          func.count(Order.userId.distinct()) + func.max(case((Order.userId.is_(None), 1), else_=0)))
+            .filter(*criteria)
+            .group_by(bucket)
+            .order_by(bucket.desc())
+            .all())
+    return {row[0]: int(row[1]) for row in rows}
 
 
 def get_settings(session: Session, key: str):
-    return session.query(SettingItem).filter(SettingItem.key == key).one_or_none()
+    return settings_store.get(session, key)
+
+
+def bump_settings_version(session: Session):
+    insert_ignore(session, SettingItem, key=VERSION_KEY, value="0")
+    session.execute(update(SettingItem)
+                    .where(SettingItem.key == VERSION_KEY)
+                    .values(value=cast(cast(SettingItem.value, Integer) + 1, String))
+                    .execution_options(synchronize_session=False))
 
 
 def update_settings(session: Session, key: str, value: str):
-    setting = get_settings(session, key)
+    setting = session.query(SettingItem).filter(SettingItem.key == key).one_or_none()
     if setting is None:
         setting = SettingItem(key=key, value=value)
         session.add(setting)
@@ -222,5 +866,7 @@ def update_settings(session: Session, key: str, value: str):
         session.delete(setting)
     else:
         setting.value = value
+    bump_settings_version(session)
     session.commit()
+    settings_store.invalidate()
     return value
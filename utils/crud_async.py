@@ -0,0 +1,30 @@
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from data.schemas import OrderSchema, UserSchema
+from utils import crud
+
+
+async def run(session: AsyncSession | Session, fn, *args, **kwargs):
+    # Runs sync crud code on the async connection when in async mode, or on the threadpool otherwise.
+    # Anything returned must already be detached from lazy loading, so callers convert to schemas inside fn.
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, session, *args, **kwargs)
+
+
+def _order_schema(order):
+    return None if order is None else OrderSchema.model_validate(order)
+
+
+async def get_order(session: AsyncSession | Session, order_id: int):
+    return await run(session, lambda db: _order_schema(crud.get_order(db, order_id)))
+
+
+async def get_order_by_number(session: AsyncSession | Session, number: str):
+    return await run(session, lambda db: _order_schema(crud.get_order_by_number(db, number)))
+
+
+async def upsert_user(session: AsyncSession | Session, user_id: str, user_name: str, pinyin: str | None = None, phone: str | None = None):
+    return await run(session, lambda db: UserSchema.model_validate(crud.upsert_user(db, user_id, user_name, pinyin, phone)))
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+
+
+class Subscription:
+    # A wake-up flag rather than a queue: subscribers re-read the state they care about when woken,
+    # so a burst of changes collapses into one wake-up and a slow client never builds a backlog
+    def __init__(self, broadcaster, loop: asyncio.AbstractEventLoop):
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.changed = asyncio.Event()
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.changed.clear()
+        return True
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster(ABC):
+    # Interface for order change notifications. publish() may be called from any thread (crud runs on the
+    # threadpool), subscribe() from a running event loop. A multi-worker deployment can swap in an implementation
+    # backed by a shared channel (e.g. Redis pub/sub or Postgres LISTEN) through set_broadcaster().
+    @abstractmethod
+    def subscribe(self) -> Subscription:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription):
+        ...
+
+    @abstractmethod
+    def publish(self):
+        ...
+
+
+class LocalBroadcaster(Broadcaster):
+    # In-process fan-out. Subscribers are grouped by event loop so one change costs a single
+    # call_soon_threadsafe per loop, however many clients are listening
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: dict[asyncio.AbstractEventLoop, set[Subscription]] = {}
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.setdefault(subscription.loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.loop)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[subscription.loop]
+
+    def publish(self):
+        with self.lock:
+            loops = list(self.subscribers)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:
+                # The loop was closed without its subscribers unsubscribing
+                with self.lock:
+                    self.subscribers.pop(loop, None)
+
+    def _wake(self, loop: asyncio.AbstractEventLoop):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(loop, ()))
+        for subscription in subscriptions:
+            subscription.changed.set()
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+
+broadcaster: Broadcaster = LocalBroadcaster()
+
+
+def set_broadcaster(value: Broadcaster):
+    global broadcaster
+    broadcaster = value
+
+
+def orders_changed():
+    broadcaster.publish()
@@ -0,0 +1,49 @@
+import base64
+import importlib.util
+import os
+
+import httpx
+
+# One pooled client for every login, so a class logging in at once reuses connections
+# instead of pinning a worker thread per upstream round trip
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=30.0)
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def exchange_code(code: str) -> dict:
+    r = await get_client().post(os.environ["ONELOGIN_HOST"] + "/oauth2/token", data={
+        "grant_type": "authorization_code",
+        "code": code,
+        "redirect_uri": os.environ["API_HOST"] + "/login/authorize"
+    }, headers={
+        "Authorization": "Basic " + base64.b64encode((os.environ["ONELOGIN_CLIENT_ID"] + ":" + os.environ["ONELOGIN_CLIENT_SECRET"]).encode("utf-8")).decode("utf-8")
+    })
+    if r.status_code == 400:
+        # Rejected codes come back as a 400 with an OAuth error body, which the caller reports
+        return r.json()
+    r.raise_for_status()
+    return r.json()
+
+
+async def get_me(access_token: str) -> dict:
+    r = await get_client().get(os.environ["ONELOGIN_HOST"] + "/api/v1/me",
+                               headers={"Authorization": "Bearer " + access_token})
+    r.raise_for_status()
+    return r.json()
@@ -0,0 +1,132 @@
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from data.models import Order, OrderedItem, OrderStatus
+
+
+class QueueEntry:
+    __slots__ = ("id", "key", "cups", "number", "type", "slot")
+
+    def __init__(self, id, created_time, cups, number, type):
+        self.id = id
+        self.key = (created_time, id)
+        self.cups = cups
+        self.number = number
+        self.type = type
+        self.slot = -1
+
+
+class OrderQueue:
+    # Waiting orders in creation order, with Fenwick trees over the order count and cup count so that
+    # "how many orders / cups are ahead of this one" is O(log n) instead of a scan of the whole queue
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.entries = {}
+        self.slots = []
+        self.order_tree = [0]
+        self.cup_tree = [0]
+        self.total_orders = 0
+        self.total_cups = 0
+
+    def _update(self, slot: int, orders: int, cups: int):
+        i = slot + 1
+        while i < len(self.order_tree):
+            self.order_tree[i] += orders
+            self.cup_tree[i] += cups
+            i += i & -i
+
+    def _prefix(self, slot: int):
+        # Sums over slots [0, slot)
+        orders = 0
+        cups = 0
+        i = slot
+        while i > 0:
+            orders += self.order_tree[i]
+            cups += self.cup_tree[i]
+            i -= i & -i
+        return orders, cups
+
+    def _reindex(self, capacity: int | None = None):
+        live = sorted((e for e in self.entries.values()), key=lambda e: e.key)
+        capacity = max(capacity or 0, len(live) * 2, 64)
+        self.slots = []
+        self.order_tree = [0] * (capacity + 1)
+        self.cup_tree = [0] * (capacity + 1)
+        for entry in live:
+            entry.slot = len(self.slots)
+            self.slots.append(entry)
+            self._update(entry.slot, 1, entry.cups)
+
+    def rebuild(self, session: Session):
+        with self.lock:
+            rows = (session.query(Order.id, Order.createdTime, Order.number, Order.type,
+                                  func.coalesce(func.sum(OrderedItem.amount), 0))
+                    .outerjoin(OrderedItem, OrderedItem.orderId == Order.id)
+                    .filter(Order.status == OrderStatus.waiting)
+                    .group_by(Order.id, Order.createdTime, Order.number, Order.type)
+                    .all())
+            self.entries = {row[0]: QueueEntry(row[0], row[1], int(row[4]), row[2], row[3]) for row in rows}
+            self.total_orders = len(self.entries)
+            self.total_cups = sum(e.cups for e in self.entries.values())
+            self._reindex()
+            self.loaded = True
+
+    def ensure_loaded(self, session: Session):
+        if not self.loaded:
+            self.rebuild(session)
+        return self
+
+    def add(self, order: Order, cups: int):
+        with self.lock:
+            if not self.loaded:
+                return
+            self.remove(order.id)
+            entry = QueueEntry(order.id, order.createdTime, cups, order.number, order.type)
+            self.entries[entry.id] = entry
+            self.total_orders += 1
+            self.total_cups += cups
+            if self.slots and entry.key < self.slots[-1].key:
+                # Re-queued orders land in the middle, which only happens on manual status changes
+                self._reindex()
+            elif len(self.slots) + 1 >= len(self.order_tree):
+                self._reindex(len(self.order_tree) * 2)
+            else:
+                entry.slot = len(self.slots)
+                self.slots.append(entry)
+                self._update(entry.slot, 1, cups)
+
+    def remove(self, order_id: int):
+        with self.lock:
+            entry = self.entries.pop(order_id, None)
+            if entry is None:
+                return
+            self.total_orders -= 1
+            self.total_cups -= entry.cups
+            self._update(entry.slot, -1, -entry.cups)
+            if len(self.slots) > 64 and len(self.entries) * 4 < len(self.slots):
+                self._reindex()
+
+    def get(self, order_id: int) -> QueueEntry | None:
+        return self.entries.get(order_id)
+
+    def ahead_of(self, order_id: int):
+        # Returns (orders, cups) strictly ahead of the given waiting order
+        with self.lock:
+            entry = self.entries.get(order_id)
+            if entry is None:
+                return None
+            return self._prefix(entry.slot)
+
+    def totals(self):
+        with self.lock:
+            return self.total_orders, self.total_cups
+
+
+queue = OrderQueue()
+
+
+def get_queue(session: Session) -> OrderQueue:
+    return queue.ensure_loaded(session)
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import orjson
+from pydantic import TypeAdapter
+from starlette.responses import Response
+
+
+class JSONBytesResponse(Response):
+    # Content that is already JSON-encoded bytes, sent as-is
+    media_type = "application/json"
+
+
+class PayloadCache:
+    # Serialized response bodies keyed by the data version they were built from. A hit skips the query, response_model
+    # validation and JSON encoding altogether; old versions simply stop being asked for and age out.
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self.adapters: dict[Any, TypeAdapter] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def serialize(self, value, schema) -> bytes:
+        adapter = self.adapters.get(schema)
+        if adapter is None:
+            adapter = self.adapters.setdefault(schema, TypeAdapter(schema))
+        # Validating once per version keeps the output identical to what response_model would have produced
+        return orjson.dumps(adapter.dump_python(adapter.validate_python(value, from_attributes=True), mode="json"))
+
+    def get(self, key: tuple, build: Callable[[], Any], schema) -> bytes:
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        body = self.serialize(build(), schema)
+        with self.lock:
+            self.entries[key] = body
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return body
+
+    def respond(self, key: tuple, build: Callable[[], Any], schema, response: Response | None = None) -> JSONBytesResponse:
+        # Returning a response skips the one injected into the route, so headers dependencies set on it are copied over
+        headers = dict(response.headers) if response is not None else None
+        return JSONBytesResponse(self.get(key, build, schema), headers=headers)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+payload_cache = PayloadCache()
+
+# Bumped after every committed change to orders or the users shown on them. In-process only, like the catalog
+# version, so /orders/today payloads depend on the app running as a single worker (enforced in main.py)
+_orders_version = 0
+_orders_lock = threading.Lock()
+
+
+def get_orders_version() -> int:
+    return _orders_version
+
+
+def orders_changed():
+    global _orders_version
+    with _orders_lock:
+        _orders_version += 1
@@ -0,0 +1,127 @@
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Annotated
+
+from fastapi import Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.orm import Session
+
+from data import database
+from data.models import RateLimitBucket
+from utils import crud
+from utils.dependencies import get_current_identity
+
+
+class Backend(ABC):
+    # take() removes one token from the bucket and returns 0, or returns how many seconds until one is available
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, rate: float, burst: int) -> float:
+        ...
+
+
+class MemoryBackend(Backend):
+    # Per-process buckets, enough for the single worker we run. Every scope shares the dict, so each entry keeps
+    # the rate and burst it was filled with. Kept in least recently used order and capped at max_keys, since keys
+    # come from client addresses and anyone can make up new ones
+    def __init__(self, max_keys: int = 65536):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buckets: OrderedDict[str, tuple[float, float, float, int]] = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at, _, _ = self.buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            retry_after = (1 - tokens) / rate if tokens < 1 else 0
+            self.buckets[key] = (tokens if tokens < 1 else tokens - 1, now, rate, burst)
+            self.buckets.move_to_end(key)
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+            return retry_after
+
+    def prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket at all. If that doesn't free enough, the least
+        # recently used buckets go too. Both leave an eighth of max_keys free, so the scan runs once per that many new
+        # keys rather than on every request once the cap is reached
+        for key, (tokens, updated_at, rate, burst) in list(self.buckets.items()):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self.buckets[key]
+        target = self.max_keys - self.max_keys // 8
+        while len(self.buckets) > target:
+            self.buckets.popitem(last=False)
+
+
+class DatabaseBackend(Backend):
+    # Buckets in the ratelimitbuckets table, shared by every worker. Refill and take are one conditional UPDATE,
+    # so concurrent requests can't both spend the last token
+    blocking = True
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        with database.ind_db() as db:
+            return self.take_with(db, key, rate, burst)
+
+    def take_with(self, session: Session, key: str, rate: float, burst: int) -> float:
+        now = time.time()
+        crud.insert_ignore(session, RateLimitBucket, key=key, tokens=float(burst), updatedAt=now)
+        refilled = RateLimitBucket.tokens + (now - RateLimitBucket.updatedAt) * rate
+        available = case((refilled > burst, float(burst)), else_=refilled)
+        # MySQL applies SET assignments left to right, tokens must be computed from the old updatedAt
+        result = session.execute(update(RateLimitBucket)
+                                 .where(RateLimitBucket.key == key, available >= 1)
+                                 .ordered_values((RateLimitBucket.tokens, available - 1),
+                                                 (RateLimitBucket.updatedAt, now))
+                                 .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            session.commit()
+            return 0
+        tokens = session.execute(select(available).where(RateLimitBucket.key == key)).scalar_one()
+        session.commit()
+        return (1 - tokens) / rate
+
+    def prune(self, session: Session, older_than: float):
+        session.execute(delete(RateLimitBucket)
+                        .where(RateLimitBucket.updatedAt < time.time() - older_than)
+                        .execution_options(synchronize_session=False))
+        session.commit()
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "database": DatabaseBackend
+}
+backend: Backend = BACKENDS[os.environ.get("RATE_LIMIT_BACKEND", "memory")]()
+
+
+class RateLimit:
+    # Route dependency: a token bucket of `burst` requests refilling at `rate` per second, per user (or per client IP
+    # for routes that don't require a login). Rejected requests get a 429 before any other work is done.
+    # Usage: @router.post(..., dependencies=[Depends(RateLimit("order", rate=0.2, burst=3))])
+    def __init__(self, scope: str, rate: float, burst: int, by_user: bool = True, backend: Backend | None = None):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.by_user = by_user
+        self.backend = backend
+
+    async def __call__(self, request: Request, authorization: Annotated[str | None, Header()] = None):
+        if self.by_user:
+            user = await get_current_identity(authorization)
+            key = f"{self.scope}:user:{user.id}"
+        else:
+            key = f"{self.scope}:ip:{request.client.host if request.client is not None else 'unknown'}"
+        current = self.backend or backend
+        if current.blocking:
+            retry_after = await run_in_threadpool(current.take, key, self.rate, self.burst)
+        else:
+            retry_after = current.take(key, self.rate, self.burst)
+        if retry_after > 0:
+            raise HTTPException(status_code=429, detail="Too many requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
@@ -0,0 +1,19 @@
+import argparse
+import datetime
+
+from data import database
+from utils import crud
+
+
+def rebuild(since: datetime.date | None = None):
+    with database.ind_db() as db:
+        return crud.rebuild_daily_stats(db, since)
+
+
+if __name__ == "__main__":
+    # python -m utils.rollup [--since YYYY-MM-DD]
+    parser = argparse.ArgumentParser(description="Rebuild the daily statistics rollup from the orders table")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, default=None,
+                        help="only rebuild business dates on or after this date (default: everything)")
+    args = parser.parse_args()
+    print(f"Rebuilt {rebuild(args.since)} day(s)")
@@ -1,9 +1,14 @@
+import datetime
+import logging
+
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from data import database
-from utils import crud
+from utils import crud, order_queue, ratelimit
 from utils.dependencies import TIME_ZONE
 
+logger = logging.getLogger(__name__)
+
 
 def enable_ordering():
     with database.ind_db() as db:
@@ -15,9 +20,46 @@ def disable_ordering():
         crud.update_settings(db, "shop-open", "0")
 
 
+def rebuild_daily_stats():
+    # Safety net for the incrementally maintained rollup, yesterday and today are recomputed from the orders
+    with database.ind_db() as db:
+        crud.rebuild_daily_stats(db, crud.get_business_date() - datetime.timedelta(days=1))
+
+
+def reconcile_user_totals():
+    with database.ind_db() as db:
+        repaired = crud.reconcile_user_totals(db)
+    if repaired:
+        logger.warning("Repaired drifted order totals of %d user(s)", repaired)
+
+
+def rebuild_order_queue():
+    # The queue only follows orders changed through crud, edits made in the admin panel or directly in the database
+    # would otherwise stay invisible to /order/estimate until the next restart
+    with database.ind_db() as db:
+        order_queue.queue.rebuild(db)
+
+
+def prune_order_changes():
+    # The board only syncs today's changes, keep yesterday's around for clients that were open over midnight
+    with database.ind_db() as db:
+        crud.prune_order_changes(db, crud.get_business_date() - datetime.timedelta(days=1))
+
+
+def prune_rate_limits():
+    if isinstance(ratelimit.backend, ratelimit.DatabaseBackend):
+        with database.ind_db() as db:
+            ratelimit.backend.prune(db, 24 * 60 * 60)
+
+
 def start_scheduler():
     scheduler = BackgroundScheduler(timezone=TIME_ZONE)
     scheduler.add_job(enable_ordering, "cron", hour=10, minute=0, day_of_week="mon-fri")
     scheduler.add_job(disable_ordering, "cron", hour=16, minute=0, day_of_week="mon-fri")
+    scheduler.add_job(rebuild_order_queue, "interval", minutes=1)
+    scheduler.add_job(rebuild_daily_stats, "cron", hour=3, minute=0)
+    scheduler.add_job(reconcile_user_totals, "cron", hour=3, minute=15)
+    scheduler.add_job(prune_order_changes, "cron", hour=3, minute=30)
+    scheduler.add_job(prune_rate_limits, "cron", hour=3, minute=45)
     scheduler.start()
     return scheduler
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from data.models import SettingItem
+
+VERSION_KEY = "settings-version"
+
+
+class SettingsStore:
+    # In-memory copy of settingsitems. Writers bump the version row in the same transaction, so other
+    # processes only need to read that one row (at most once per check_interval) to know they're stale.
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.values: dict[str, str | None] | None = None
+        self.version = 0
+        self.checked_at = 0.0
+
+    def refresh(self, session: Session):
+        if self.values is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return
+        row = session.query(SettingItem.value).filter(SettingItem.key == VERSION_KEY).one_or_none()
+        version = int(row[0]) if row is not None and row[0] is not None else 0
+        if self.values is None or version != self.version:
+            values = {item.key: item.value for item in session.query(SettingItem).all()}
+            with self.lock:
+                self.values = values
+                self.version = version
+        self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        self.checked_at = 0.0
+
+    def get(self, session: Session, key: str) -> str | None:
+        self.refresh(session)
+        return self.values.get(key)
+
+    def get_int(self, session: Session, key: str, default: int) -> int:
+        value = self.get(session, key)
+        try:
+            return int(value) if value is not None else default
+        except ValueError:
+            return default
+
+    def get_bool(self, session: Session, key: str, default: bool = False) -> bool:
+        value = self.get(session, key)
+        return default if value is None else value == "1"
+
+
+settings_store = SettingsStore()
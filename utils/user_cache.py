@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserSnapshot:
+    # What most routes need to know about the caller, detached from any session
+    __slots__ = ("id", "permissions", "blocked")
+
+    def __init__(self, id: str, permissions: str, blocked: bool):
+        self.id = id
+        self.permissions = permissions or ""
+        self.blocked = bool(blocked)
+
+
+class UserCache:
+    # Bounded LRU of verified token -> user snapshot, with a TTL so permission changes made
+    # outside this process are still picked up eventually
+    def __init__(self, max_size: int = 4096, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tokens_by_user = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> UserSnapshot | None:
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, snapshot: UserSnapshot, token_expires: float):
+        with self.lock:
+            self._remove(token)
+            self.entries[token] = (min(time.time() + self.ttl, token_expires), snapshot)
+            self.tokens_by_user.setdefault(snapshot.id, set()).add(token)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, token: str):
+        entry = self.entries.pop(token, None)
+        if entry is not None:
+            tokens = self.tokens_by_user.get(entry[1].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self.tokens_by_user[entry[1].id]
+
+    def invalidate(self, user_id: str):
+        with self.lock:
+            for token in list(self.tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+user_cache = UserCache()